@@ -34,6 +34,7 @@ import sys
 import numpy
 
 import oamap.generator
+import oamap.util
 
 if sys.version_info[0] > 2:
     basestring = str
@@ -209,10 +210,15 @@ class ListCounts(PackedSource):
 
     @staticmethod
     def fromcounts(array):
+        offsets = oamap.util.derived(array, "fromcounts", ListCounts._offsets)
+        return offsets[:-1], offsets[1:]
+
+    @staticmethod
+    def _offsets(array):
         offsets = numpy.empty(len(array) + 1, dtype=oamap.generator.ListGenerator.posdtype)
         offsets[0] = 0
         offsets[1:] = numpy.cumsum(array)
-        return offsets[:-1], offsets[1:]
+        return offsets
 
     @staticmethod
     def tocounts(starts, stops):
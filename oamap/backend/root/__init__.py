@@ -28,6 +28,8 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import weakref
+
 import numpy
 
 import oamap.schema
@@ -185,6 +187,15 @@ class ROOTArrays(object):
     def __init__(self, tree):
         self._tree = tree
         self._keycache = {}
+        self._offsetscache = weakref.WeakValueDictionary()
+
+    def _offsets(self, length, stride):
+        # fixed-size dimensions have the same offsets every time they're read (while any reader still holds them)
+        key = (length, stride)
+        out = self._offsetscache.get(key)
+        if out is None:
+            out = self._offsetscache[key] = numpy.arange(0, (length + 1)*stride, stride)
+        return out
 
     def getall(self, roles):
         import uproot
@@ -216,12 +227,12 @@ class ROOTArrays(object):
                     stride *= array.shape[depth + 1]
 
                 if isinstance(role, oamap.generator.StartsRole) and role not in out:
-                    offsets = numpy.arange(0, (length + 1)*stride, stride)
+                    offsets = self._offsets(length, stride)
                     out[role] = offsets[:-1]
                     out[role.stops] = offsets[1:]
 
                 elif isinstance(role, oamap.generator.StopsRole) and role not in out:
-                    offsets = numpy.arange(0, (length + 1)*stride, stride)
+                    offsets = self._offsets(length, stride)
                     out[role.starts] = offsets[:-1]
                     out[role] = offsets[1:]
 
@@ -97,7 +97,7 @@ else:
                     return numba.types.boolean
 
                 elif isinstance(typ.schema, oamap.schema.Primitive) and attr == "dtype":
-                    return numba.types.DType(numba.from_dtype(typ.schema.dtype))
+                    return numba.types.DType(from_dtype(typ.schema.dtype))
 
                 elif isinstance(typ.schema, oamap.schema.List) and attr == "content":
                     return typ.content()
@@ -130,9 +130,9 @@ else:
                 arg, = args
                 if isinstance(schematype.schema, oamap.schema.Primitive):
                     if schematype.schema.nullable:
-                        return numba.types.optional(numba.from_dtype(schematype.schema.dtype))(arg)
+                        return numba.types.optional(from_dtype(schematype.schema.dtype))(arg)
                     else:
-                        return numba.from_dtype(schematype.schema.dtype)(arg)
+                        return from_dtype(schematype.schema.dtype)(arg)
 
                 elif isinstance(schematype.schema, (oamap.schema.List, oamap.schema.Union, oamap.schema.Record, oamap.schema.Tuple)):
                     if isinstance(arg, UnionProxyNumbaType):
@@ -162,7 +162,7 @@ else:
             return literal_boolean(1 if typ.schema.nullable else 0)
 
         elif attr == "dtype":
-            return numba.targets.imputils.impl_ret_untracked(context, builder, numba.types.DType(numba.from_dtype(typ.schema.dtype)), context.get_dummy_value())
+            return numba.targets.imputils.impl_ret_untracked(context, builder, numba.types.DType(from_dtype(typ.schema.dtype)), context.get_dummy_value())
 
         else:
             return numba.cgutils.create_struct_proxy(typ)(context, builder)._getvalue()
@@ -201,7 +201,7 @@ else:
         elif isinstance(argtype, primtypes):
             # do a compile-time check
             if isinstance(schematype.schema, oamap.schema.Primitive):
-                return literal_boolean(numba.from_dtype(schematype.schema.dtype) == argtype)
+                return literal_boolean(from_dtype(schematype.schema.dtype) == argtype)
             else:
                 return literal_boolean(False)
 
@@ -408,7 +408,7 @@ else:
                 return numba.types.optional(tpe)
 
         if isinstance(generator, oamap.generator.PrimitiveGenerator):
-            return numba.from_dtype(generator.dtype)
+            return from_dtype(generator.dtype)
 
         elif isinstance(generator, oamap.generator.ListGenerator):
             return ListProxyNumbaType(generator)
@@ -431,6 +431,12 @@ else:
         else:
             raise AssertionError("unrecognized generator type: {0} ({1})".format(generator.__class__, repr(generator)))
 
+    def from_dtype(dtype):
+        # compiled code sees non-native arrays as native numbers; arrayitem swaps the bytes on load
+        if not dtype.isnative:
+            dtype = dtype.newbyteorder("=")
+        return numba.from_dtype(dtype)
+
     def literal_int(value, itemsize):
         return llvmlite.llvmpy.core.Constant.int(llvmlite.llvmpy.core.Type.int(itemsize * 8), value)
 
@@ -494,11 +500,31 @@ else:
 
         raise_exception(context, builder, builder.icmp_unsigned(">=", at, len), RuntimeError("array index out of range"))
 
-        finalptr = builder.inttoptr(
-            builder.add(ptr, builder.mul(at, literal_int64(dtype.itemsize))),
-            llvmlite.llvmpy.core.Type.pointer(context.get_value_type(numba.from_dtype(dtype))))
+        if dtype.isnative:
+            finalptr = builder.inttoptr(
+                builder.add(ptr, builder.mul(at, literal_int64(dtype.itemsize))),
+                llvmlite.llvmpy.core.Type.pointer(context.get_value_type(from_dtype(dtype))))
+
+            return numba.targets.arrayobj.load_item(context, builder, from_dtype(dtype)[:], finalptr)
 
-        return numba.targets.arrayobj.load_item(context, builder, numba.from_dtype(dtype)[:], finalptr)
+        else:
+            # read the original (non-native) buffer as raw bytes and swap them, rather than converting the whole array
+            def swapped(position, dtype):
+                raw = builder.load(builder.inttoptr(position, llvmlite.llvmpy.core.Type.pointer(llvmlite.llvmpy.core.Type.int(dtype.itemsize * 8))))
+                if dtype.kind == "f":
+                    return builder.bitcast(builder.bswap(raw), context.get_value_type(from_dtype(dtype)))
+                else:
+                    return builder.bswap(raw)
+
+            position = builder.add(ptr, builder.mul(at, literal_int64(dtype.itemsize)))
+            if dtype.kind == "c":
+                part = numpy.dtype("f{0}".format(dtype.itemsize // 2))
+                out = context.make_complex(builder, from_dtype(dtype))
+                out.real = swapped(position, part)
+                out.imag = swapped(builder.add(position, literal_int64(part.itemsize)), part)
+                return out._getvalue()
+            else:
+                return swapped(position, dtype)
 
     def raise_exception(context, builder, case, exception):
         if case is None:
@@ -525,7 +551,7 @@ else:
         typ = typeof_generator(generator, checkmasked=False)
 
         if isinstance(generator, oamap.generator.PrimitiveGenerator):
-            return llvmlite.llvmpy.core.Constant.null(context.get_value_type(numba.from_dtype(generator.dtype)))
+            return llvmlite.llvmpy.core.Constant.null(context.get_value_type(from_dtype(generator.dtype)))
 
         elif isinstance(generator, oamap.generator.ListGenerator):
             listproxy = numba.cgutils.create_struct_proxy(typ)(context, builder)
@@ -709,12 +735,12 @@ else:
 
             elif isinstance(lhs, UnionProxyNumbaType) and isinstance(rhs, primtypes):
                 for x in lhs.generator.schema.possibilities:
-                    if isinstance(x, oamap.schema.Primitive) and numba.from_dtype(x.dtype) == rhs:
+                    if isinstance(x, oamap.schema.Primitive) and from_dtype(x.dtype) == rhs:
                         return numba.types.boolean(*args)
 
             elif isinstance(rhs, UnionProxyNumbaType) and isinstance(lhs, primtypes):
                 for x in rhs.generator.schema.possibilities:
-                    if isinstance(x, oamap.schema.Primitive) and numba.from_dtype(x.dtype) == lhs:
+                    if isinstance(x, oamap.schema.Primitive) and from_dtype(x.dtype) == lhs:
                         return numba.types.boolean(*args)
 
     ################################################################ ListProxy
@@ -1197,7 +1223,7 @@ else:
         lproxy = numba.cgutils.create_struct_proxy(ltype)(context, builder, value=lval)
         out_ptr = numba.cgutils.alloca_once_value(builder, literal_boolean(False))
         for li, lgen in enumerate(ltype.generator.possibilities):
-            if isinstance(lgen.schema, oamap.schema.Primitive) and numba.from_dtype(lgen.schema.dtype) == rtype:
+            if isinstance(lgen.schema, oamap.schema.Primitive) and from_dtype(lgen.schema.dtype) == rtype:
                 with builder.if_then(builder.icmp_signed("==", lproxy.tag, literal_int(li, ltype.generator.tagdtype.itemsize))):
                     ldata = generate(context, builder, lgen, lproxy.baggage, lproxy.ptrs, lproxy.lens, lproxy.offset)
                     with builder.if_then(context.get_function("==", numba.types.boolean(typeof_generator(lgen), rtype))(builder, (ldata, rval))):
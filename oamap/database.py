@@ -33,11 +33,13 @@ import json
 import os
 import shutil
 import sys
+import threading
 import time
 
 import oamap.schema
 import oamap.dataset
 import oamap.extension.common
+import oamap.util
 
 if sys.version_info[0] > 2:
     basestring = str
@@ -129,6 +131,8 @@ class FilesystemBackend(WritableBackend):
 ################################################################ DictBackend (concrete)
 
 class DictBackend(WritableBackend):
+    processlocal = True
+
     def __init__(self, arrays=None, refcounts=None):
         if arrays is None:
             arrays = {}
@@ -177,7 +181,7 @@ class Database(object):
         out[namespace] = backend
         return out
 
-    def __init__(self, connection, backends={}, namespace="", executor=oamap.dataset.SingleThreadExecutor()):
+    def __init__(self, connection, backends={}, namespace="", executor=None):
         self._connection = connection
         if isinstance(backends, Backend):
             backends = {namespace: backends}
@@ -185,7 +189,7 @@ class Database(object):
         for n, x in backends.items():
             self[n] = x
         self._namespace = namespace
-        self._executor = executor
+        self._executor = oamap.dataset.SingleThreadExecutor() if executor is None else executor
 
     @property
     def connection(self):
@@ -228,6 +232,9 @@ class Database(object):
     def delete(self, dataset):
         return NotImplementedError("missing implementation for {0}.delete".format(self.__class__))
 
+    def aget(self, dataset, timeout=None, loop=None):
+        raise NotImplementedError("missing implementation for {0}.aget".format(self.__class__))
+
     def _normalize_namespace(self, namespace):
         if namespace is None:
             namespace = self._namespace
@@ -248,7 +255,8 @@ class Database(object):
                                          packing=packing,
                                          extension=obj.get("extension", None),
                                          doc=obj.get("doc", None),
-                                         metadata=obj.get("metadata", None))
+                                         metadata=obj.get("metadata", None),
+                                         stats=obj.get("stats", None))
         else:
             return oamap.dataset.Data(name,
                                       schema,
@@ -272,6 +280,8 @@ class Database(object):
             obj["doc"] = data._doc
         if data._metadata is not None:
             obj["metadata"] = data._metadata
+        if isinstance(data, oamap.dataset.Dataset) and data._stats is not None:
+            obj["stats"] = data._stats
         return obj
 
     def fromdata(self, name, schema, *partitions, **opts):
@@ -311,7 +321,7 @@ class Database(object):
             return node
         schema = schema.replace(setnamespace)
 
-        generator = schema.generator(prefix=backend.prefix(name), delimiter=backend.delimiter(), packing=packing)
+        generator = schema.generator(prefix=backend.prefix(name), delimiter=backend.delimiter(), packing=packing, memoize=False)
         generator._requireall()
         roles = generator._togetall({}, generator._newcache(), True, set())
 
@@ -332,8 +342,10 @@ class Database(object):
 
         elif isinstance(schema, oamap.schema.List):
             offsets = [0]
+            stats = []
             for partitionid, partition in enumerate(partitions):
                 data = generator.fromdata(partition)
+                stats.append(oamap.dataset._statistics(data))
                 roles2arrays = dict((x, data._arrays[str(x)]) for x in roles)
                 startsrole = oamap.generator.StartsRole(generator.starts, generator.namespace, None)
                 stopsrole = oamap.generator.StopsRole(generator.stops, generator.namespace, None)
@@ -355,7 +367,7 @@ class Database(object):
 
                 offsets.append(offsets[-1] + len(data))
 
-            out = oamap.dataset.Dataset(name, generator.namedschema(), self._backends, self._executor, offsets, extension=extension, packing=packing, doc=doc, metadata=metadata)
+            out = oamap.dataset.Dataset(name, generator.namedschema(), self._backends, self._executor, offsets, extension=extension, packing=packing, doc=doc, metadata=metadata, stats=oamap.dataset._mergestatistics(stats))
 
         else:
             raise TypeError("can only create datasets from proxy types (list, records, tuples)")
@@ -365,8 +377,8 @@ class Database(object):
 ################################################################ InMemoryDatabase (concrete)
 
 class InMemoryDatabase(Database):
-    def __init__(self, backends={}, namespace="", datasets={}):
-        super(InMemoryDatabase, self).__init__(None, backends, namespace)
+    def __init__(self, backends={}, namespace="", datasets={}, executor=None):
+        super(InMemoryDatabase, self).__init__(None, backends, namespace, executor)
 
         if isinstance(datasets, oamap.dataset.Data):
             datasets = {datasets.name: datasets}
@@ -397,6 +409,15 @@ class InMemoryDatabase(Database):
         else:
             return self._json2dataset(dataset, ds)
 
+    def aget(self, dataset, timeout=None, loop=None):
+        ds = self._datasets.get(dataset, None)
+        if ds is None:
+            raise KeyError("no dataset named {0}".format(repr(dataset)))
+        elif isinstance(ds, list):
+            return oamap.util.awaitable(ds[-1], loop=loop, then=lambda result: self.get(dataset), timeout=timeout)
+        else:
+            return oamap.util.awaitable(oamap.dataset.SingleThreadExecutor.PseudoFuture(None), loop=loop, then=lambda result: self.get(dataset))
+
     def put(self, dataset, value, namespace=None):
         if not isinstance(value, oamap.dataset._Data):
             raise TypeError("can only put Datasets in Database")
@@ -482,9 +503,34 @@ class InMemoryDatabase(Database):
 
 ################################################################ FilesystemDatabase (concrete)
 
+_written = threading.Condition()
+_writtenlisteners = {}
+
+def _notifywritten(path):
+    with _written:
+        _written.notify_all()
+        listeners = _writtenlisteners.pop(path, [])
+    for fcn in listeners:
+        fcn()
+
+class _Written(object):
+    # future-like readiness of a dataset.json file
+    def __init__(self, path):
+        self._path = path
+    def done(self):
+        return os.path.exists(self._path)
+    def result(self, timeout=None):
+        return self._path
+    def add_done_callback(self, fcn):
+        with _written:
+            if not self.done():
+                _writtenlisteners.setdefault(self._path, []).append(lambda: fcn(self))
+                return
+        fcn(self)
+
 class FilesystemDatabase(Database):
-    def __init__(self, directory, backends={}, namespace=""):
-        super(FilesystemDatabase, self).__init__(None, backends, namespace)
+    def __init__(self, directory, backends={}, namespace="", executor=None):
+        super(FilesystemDatabase, self).__init__(None, backends, namespace, executor)
         self._directory = directory
 
     def list(self):
@@ -497,11 +543,27 @@ class FilesystemDatabase(Database):
 
     def get(self, dataset, timeout=None):
         dsjson = os.path.join(self._directory, dataset, "dataset.json")
-        while not os.path.exists(dsjson):
-            time.sleep(0)
+        if not os.path.exists(dsjson):
+            # woken as soon as a put in this process writes it; writes from other processes are seen with a backoff
+            deadline = None if timeout is None else time.time() + timeout
+            delay = 1e-4
+            with _written:
+                while not os.path.exists(dsjson):
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise oamap.util.TimeoutError("dataset {0} was not written in {1} seconds".format(repr(dataset), timeout))
+                        delay = min(delay, remaining)
+                    _written.wait(delay)
+                    delay = min(2*delay, 0.1)
+
         with open(dsjson) as ds:
             return self._json2dataset(dataset, json.load(ds))
 
+    def aget(self, dataset, timeout=None, loop=None):
+        dsjson = os.path.join(self._directory, dataset, "dataset.json")
+        return oamap.util.awaitable(_Written(dsjson), loop=loop, then=lambda result: self.get(dataset), timeout=timeout, poll=True)
+
     def put(self, dataset, value, namespace=None):
         if not isinstance(value, oamap.dataset._Data):
             raise TypeError("can only put Datasets in Database")
@@ -520,9 +582,14 @@ class FilesystemDatabase(Database):
                 self[ns] = backend
 
         def update(data):
-            with open(dsjson, "w") as ds:
+            # written whole under a temporary name so that readers never see a partial file
+            if not os.path.exists(os.path.dirname(dsjson)):
+                os.makedirs(os.path.dirname(dsjson))
+            with open(dsjson + ".writing", "w") as ds:
                 json.dump(Database._dataset2json(data), ds)
-                return data
+            os.rename(dsjson + ".writing", dsjson)
+            _notifywritten(dsjson)
+            return data
 
         value.transform(dataset, namespace, update)
 
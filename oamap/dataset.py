@@ -31,6 +31,13 @@
 import copy
 import numbers
 import functools
+import inspect
+import os
+import select
+import sys
+import threading
+import time
+import traceback
 
 import numpy
 
@@ -39,6 +46,10 @@ import oamap.operations
 import oamap.proxy
 import oamap.schema
 import oamap.util
+from oamap.util import OrderedDict
+
+if sys.version_info[0] > 2:
+    basestring = str
         
 class SingleThreadExecutor(object):
     class PseudoFuture(object):
@@ -48,6 +59,8 @@ class SingleThreadExecutor(object):
             return self._result
         def done(self):
             return True
+        def add_done_callback(self, fcn):
+            fcn(self)
         def exception(self, timeout=None):
             raise NotImplementedError
         def traceback(self, timeout=None):
@@ -58,6 +71,282 @@ class SingleThreadExecutor(object):
         kwargs = dict((n, x.result() if isinstance(x, self.PseudoFuture) else x) for n, x in kwargs.items())
         return self.PseudoFuture(fcn(*args, **kwargs))
 
+from oamap.util import TimeoutError
+
+# forks a worker per task from a manager thread; Dataset does not prefetch in background threads with this executor,
+# since forking while another thread holds a lock would leave that lock held forever in the worker
+class MultiprocessExecutor(object):
+    class Future(object):
+        def __init__(self, executor, fcn, args, kwargs):
+            self._executor = executor
+            self._fcn = fcn
+            self._args = args
+            self._kwargs = kwargs
+            self._local = any(isinstance(x, MultiprocessExecutor.Future) for x in self._dependencies())
+            self._done = False
+            self._result = None
+            self._exception = None
+            self._traceback = None
+            self._callbacks = []
+
+        def _dependencies(self):
+            for x in self._args + tuple(self._kwargs.values()):
+                if isinstance(x, (tuple, list)):
+                    for y in x:
+                        yield y
+                else:
+                    yield x
+
+        def _ready(self):
+            return all(x._done for x in self._dependencies() if isinstance(x, MultiprocessExecutor.Future))
+
+        def _resolve(self, x):
+            if isinstance(x, (tuple, list)):
+                return type(x)(self._resolve(y) for y in x)      # the same containers as _dependencies
+            return x.result() if isinstance(x, MultiprocessExecutor.Future) else x
+
+        def _set(self, result, exception, traceback):
+            with self._executor._condition:
+                self._result = result
+                self._exception = exception
+                self._traceback = traceback
+                self._done = True
+                self._fcn = self._args = self._kwargs = None
+                self._executor._condition.notify_all()
+                callbacks, self._callbacks = self._callbacks, []
+            for fcn in callbacks:
+                fcn(self)
+
+        def _wait(self, timeout):
+            starttime = time.time()
+            with self._executor._condition:
+                while not self._done:
+                    if timeout is None:
+                        self._executor._condition.wait()
+                    else:
+                        remaining = timeout - (time.time() - starttime)
+                        if remaining <= 0:
+                            raise TimeoutError("task did not finish in {0} seconds".format(timeout))
+                        self._executor._condition.wait(remaining)
+
+        def result(self, timeout=None):
+            self._wait(timeout)
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+        def done(self):
+            return self._done
+
+        def add_done_callback(self, fcn):
+            with self._executor._condition:
+                if not self._done:
+                    self._callbacks.append(fcn)
+                    return
+            fcn(self)
+
+        def exception(self, timeout=None):
+            self._wait(timeout)
+            return self._exception
+
+        def traceback(self, timeout=None):
+            self._wait(timeout)
+            return self._traceback
+
+    def __init__(self, numworkers=None, directory=None, minbytes=1024):
+        if not hasattr(os, "fork"):
+            raise NotImplementedError("MultiprocessExecutor requires os.fork (POSIX systems only)")
+        if numworkers is None:
+            import multiprocessing
+            numworkers = multiprocessing.cpu_count()
+        if numworkers < 1:
+            raise ValueError("numworkers must be at least 1")
+        self._numworkers = numworkers
+        self._directory = directory
+        self._minbytes = minbytes
+        self._condition = threading.Condition()
+        self._pending = []
+        self._running = {}
+        self._thread = None
+        self._shutdown = False
+        self._wakeread, self._wakewrite = os.pipe()
+
+    def __del__(self):
+        self._closepipe()
+
+    @property
+    def numworkers(self):
+        return self._numworkers
+
+    def submit(self, fcn, *args, **kwargs):
+        future = self.Future(self, fcn, args, kwargs)
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot submit tasks to a MultiprocessExecutor after shutdown")
+            self._pending.append(future)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._manage)
+                self._thread.daemon = True
+                self._thread.start()
+        os.write(self._wakewrite, b"x")
+        return future
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._shutdown = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            if not wait:
+                return                                                 # the manager closes the pipe when it runs out of work
+            thread.join()
+        self._closepipe()
+
+    def _closepipe(self):
+        with self._condition:
+            fds = [x for x in (getattr(self, "_wakeread", None), getattr(self, "_wakewrite", None)) if x is not None]
+            self._wakeread = self._wakewrite = None
+        for fd in fds:
+            os.close(fd)
+
+    def _manage(self):
+        while True:
+            with self._condition:
+                if len(self._pending) == 0 and len(self._running) == 0:
+                    self._thread = None
+                    if self._shutdown:
+                        self._closepipe()
+                    return
+                startable = []
+                for future in self._pending:
+                    if future._ready() and (future._local or len(self._running) + len(startable) < self._numworkers):
+                        startable.append(future)
+                for future in startable:
+                    self._pending.remove(future)
+
+            for future in startable:
+                if future._local:
+                    self._runlocal(future)
+                else:
+                    self._start(future)
+
+            if len(startable) == 0:
+                readable, _, _ = select.select([self._wakeread] + list(self._running), [], [])
+                for fd in readable:
+                    if fd == self._wakeread:
+                        os.read(self._wakeread, 4096)
+                    else:
+                        self._read(fd)
+
+    def _runlocal(self, future):
+        # tasks that depend on other tasks' results (e.g. collecting partitions) run in this process
+        try:
+            args = tuple(future._resolve(x) for x in future._args)
+            kwargs = dict((n, future._resolve(x)) for n, x in future._kwargs.items())
+            result = future._fcn(*args, **kwargs)
+        except Exception as err:
+            future._set(None, err, traceback.format_exc())
+        else:
+            future._set(result, None, None)
+
+    def _start(self, future):
+        readfd, writefd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(readfd)
+                try:
+                    out = (future._fcn(*future._args, **future._kwargs), None, None)
+                except Exception as err:
+                    out = (None, err, traceback.format_exc())
+                try:
+                    data = oamap.util.shareddumps(out, self._directory, self._minbytes)
+                except Exception as err:
+                    data = oamap.util.shareddumps((None, RuntimeError("result could not be sent to parent process: {0}".format(err)), traceback.format_exc()))
+                view = memoryview(data)
+                while len(view) > 0:
+                    view = view[os.write(writefd, view):]
+                os.close(writefd)
+            finally:
+                os._exit(0)
+
+        else:
+            os.close(writefd)
+            with self._condition:
+                self._running[readfd] = (pid, future, [])
+
+    def _read(self, fd):
+        pid, future, chunks = self._running[fd]
+        chunk = os.read(fd, 1048576)
+        if len(chunk) > 0:
+            chunks.append(chunk)
+        else:
+            os.close(fd)
+            os.waitpid(pid, 0)
+            with self._condition:
+                del self._running[fd]
+            try:
+                result, exception, tb = oamap.util.sharedloads(b"".join(chunks))
+            except Exception as err:
+                future._set(None, RuntimeError("worker process {0} died without returning a result: {1}".format(pid, err)), traceback.format_exc())
+            else:
+                future._set(result, exception, tb)
+
+################################################################ instrumentation of actions
+
+class _RecordedFuture(object):
+    # a task's future that unwraps (result, recording, pid), merging the task's recording into the action's the first time
+    def __init__(self, future, recording, outer):
+        self._future = future
+        self._recording = recording
+        self._outer = outer
+        self._merged = False
+
+    def _unwrap(self, timeout=None):
+        result, recording, pid = self._future.result(timeout)
+        if not self._merged:
+            self._merged = True
+            self._recording.merge(recording)
+            if pid != os.getpid():
+                # loads in this process were seen by the outer recordings directly
+                for outer in self._outer:
+                    outer.merge(recording)
+        return result
+
+    def result(self, timeout=None):
+        return self._unwrap(timeout)
+
+    def done(self):
+        return self._future.done()
+
+    def add_done_callback(self, fcn):
+        return self._future.add_done_callback(lambda future: fcn(self))
+
+    def exception(self, timeout=None):
+        return self._future.exception(timeout)
+
+    def traceback(self, timeout=None):
+        return self._future.traceback(timeout)
+
+def _recordedtask(task, *args):
+    with oamap.util.Recording(local=True) as recording:
+        result = task(*args)
+    return result, recording, os.getpid()
+
+def _recordedsubmit(executor):
+    # only while some Recording is active do tasks record, each in its own thread or process
+    outer = oamap.util.activerecordings()
+    if len(outer) == 0:
+        return executor.submit, None
+    recording = oamap.util.Recording()
+    def submit(task, *args):
+        return _RecordedFuture(executor.submit(_recordedtask, task, *args), recording, outer)
+    return submit, recording
+
+def _withrecording(combiner, recording):
+    if recording is not None:
+        combiner.recording = recording
+    return combiner
+
 class Operation(object):
     def __init__(self, name, args, kwargs, function):
         self._name = name
@@ -134,6 +423,21 @@ class Operable(object):
                 return out.act(combiner)
             return action
 
+        def newasyncaction(name, function):
+            @functools.wraps(function)
+            def asyncaction(self, *args, **kwargs):
+                loop = kwargs.pop("loop", None)
+                try:
+                    combiner = kwargs.pop("combiner")
+                except KeyError:
+                    combiner = function.combiner
+                out = self.__class__.__new__(self.__class__)
+                Operable.__init__(out)
+                out.__dict__ = self.__dict__.copy()
+                out._operations = self._operations + (Action(name, args, kwargs, function),)
+                return out.act_async(combiner, loop=loop)
+            return asyncaction
+
         for n, x in oamap.operations.recastings.items():
             setattr(Operable, n, oamap.util.MethodType(newrecasting(n, x), None, Operable))
 
@@ -142,10 +446,90 @@ class Operable(object):
 
         for n, x in oamap.operations.actions.items():
             setattr(Operable, n, oamap.util.MethodType(newaction(n, x), None, Operable))
+            setattr(Operable, n + "_async", oamap.util.MethodType(newasyncaction(n, x), None, Operable))
 
     def _notransformations(self):
         return all(isinstance(x, Recasting) for x in self._operations)
 
+    def _fused(self):
+        # filters between an action and the transformations before them run inside the action's function;
+        # defines that nothing later reads are dropped (a define that is read stops the fusion)
+        if len(self._operations) == 0 or not isinstance(self._operations[-1], Action) or not hasattr(self._operations[-1].function, "fuse"):
+            return self
+
+        action = self._operations[-1]
+        actionargs = inspect.getcallargs(action.function, None, *action.args, **action.kwargs)
+        names = oamap.operations._fcnnames(actionargs["fcn"])
+
+        predicates = []
+        index = len(self._operations) - 1
+        while index > 0 and isinstance(self._operations[index - 1], Transformation):
+            operation = self._operations[index - 1]
+            opargs = inspect.getcallargs(operation.function, None, *operation.args, **operation.kwargs)
+            if opargs.get("at", None) != actionargs["at"]:
+                break
+
+            if operation.function is oamap.operations.transformations.get("filter", None):
+                if not isinstance(opargs["args"], tuple):
+                    try:
+                        opargs["args"] = tuple(opargs["args"])
+                    except TypeError:
+                        opargs["args"] = (opargs["args"],)
+                predicates.insert(0, (opargs["fcn"], opargs["args"]))
+                morenames = oamap.operations._fcnnames(opargs["fcn"])
+                names = None if names is None or morenames is None else names.union(morenames)
+
+            elif operation.function is oamap.operations.transformations.get("define", None) and names is not None and opargs["fieldname"] not in names:
+                pass
+
+            else:
+                break
+            index -= 1
+
+        if index == len(self._operations) - 1:
+            return self
+
+        del actionargs["data"]
+        args, kwargs = action.function.fuse(predicates, **actionargs)
+
+        out = self.__class__.__new__(self.__class__)
+        Operable.__init__(out)
+        out.__dict__ = self.__dict__.copy()
+        out._operations = self._operations[:index] + (Action(action.name, args, kwargs, action.function),)
+        return out
+
+    def _plan(self, data):
+        roles = OrderedDict()
+        for operation in self._operations:
+            if isinstance(operation, Recasting):
+                try:
+                    data = operation.apply(data)
+                except Exception:
+                    break
+            else:
+                # transformations only add to the schema, so later operations are planned against the data before them
+                plan = getattr(operation.function, "plan", None)
+                if plan is None:
+                    break
+                try:
+                    nodes = plan(data._generator.namedschema(), *operation.args, **operation.kwargs)
+                except Exception:
+                    break
+                for x in oamap.operations._noderoles(nodes):
+                    roles[x] = None
+        return list(roles)
+
+    def _preload(self, data):
+        if isinstance(data, oamap.proxy.Proxy) and isinstance(data._arrays, DataArrays):
+            roles = [x for x in self._plan(data) if x not in data._arrays._preloaded]
+            if len(roles) > 0:
+                data._arrays.preload(roles, data._generator.packing)
+
+    def _unpreload(self, data):
+        # planned arrays that nothing read (the plan over-approximates) are not kept for the life of the partition
+        if isinstance(data, oamap.proxy.Proxy) and isinstance(data._arrays, DataArrays):
+            data._arrays._preloaded.clear()
+
 Operable.update_operations()
 
 class _Data(Operable):
@@ -194,6 +578,10 @@ class _Data(Operable):
     def arrays(self):
         return DataArrays(self._backends)
 
+    def _checkwritable(self, namespace):
+        if isinstance(self._executor, MultiprocessExecutor) and getattr(self._backends.get(namespace, None), "processlocal", False):
+            raise TypeError("backend for namespace {0} only holds arrays in this process; worker processes of a MultiprocessExecutor cannot write to it".format(repr(namespace)))
+
     def transform(self, name, namespace, update):
         if self._notransformations():
             result = self()
@@ -206,8 +594,11 @@ class _Data(Operable):
             return [SingleThreadExecutor.PseudoFuture(update(out))]
 
         else:
+            self._checkwritable(namespace)
+
             def task(name, dataset, namespace, update):
-                result = dataset()
+                result = data = dataset()
+                dataset._preload(data)
                 for operation in dataset._operations:
                     result = operation.apply(result)
 
@@ -220,6 +611,7 @@ class _Data(Operable):
                 else:
                     for n, x in roles2arrays.items():
                         active[str(n)] = x
+                dataset._unpreload(data)
                 
                 if isinstance(result, oamap.proxy.ListProxy):
                     out = Dataset(name, schema, dataset._backends, dataset._executor, [0, len(result)], extension=dataset._extension, packing=None, doc=dataset._doc, metadata=dataset._metadata)
@@ -231,12 +623,18 @@ class _Data(Operable):
 
     def act(self, combiner):
         def task(dataset):
-            result = dataset()
+            result = data = dataset()
+            dataset._preload(data)
             for operation in dataset._operations:
                 result = operation.apply(result)
+            dataset._unpreload(data)
             return result
 
-        return combiner([self._executor.submit(task, self)])
+        submit, recording = _recordedsubmit(self._executor)
+        return _withrecording(combiner([submit(task, self._fused())]), recording)
+
+    def act_async(self, combiner, loop=None):
+        return oamap.util.awaitable(self.act(combiner), loop=loop)
             
 class Data(_Data):
     def __call__(self):
@@ -257,36 +655,211 @@ class DataArrays(object):
         self._backends = backends
         self._active = {}
         self._partitionid = 0
+        self._preloaded = {}
+        self._preloading = False
+        self._holding = False
 
     def _toplevel(self, out, filtered):
         return filtered
 
     def getall(self, roles):
+        recordings = oamap.util.activerecordings()
+        if len(recordings) > 0:
+            starttime = time.time()
+
         out = {}
         for namespace, backend in self._backends.items():
             filtered = self._toplevel(out, [x for x in roles if x.namespace == namespace])
 
+            # served once: from then on the array is held (and counted, and evictable) by whichever cache asked for it,
+            # unless several readers (views of a split partition, which have their own caches) are sharing these arrays
+            for x in [x for x in filtered if x in self._preloaded]:
+                out[x] = self._preloaded[x] if self._holding else self._preloaded.pop(x)
+                filtered.remove(x)
+
             if len(filtered) > 0:
                 active = self._active.get(namespace, None)
                 if active is None:
                     active = self._active[namespace] = backend.instantiate(self._partitionid)
 
+                if len(recordings) > 0:
+                    backendtime = time.time()
+
                 if hasattr(active, "getall"):
-                    out.update(active.getall(filtered))
+                    got = active.getall(filtered)
                 else:
-                    for x in roles:
-                        out[x] = active[str(x)]
+                    got = dict((x, active[str(x)]) for x in filtered)
+
+                for recording in recordings:
+                    recording.call("backend", time.time() - backendtime)
+
+                if self._preloading or self._holding:
+                    self._preloaded.update(got)
+                out.update(got)
+
+        for recording in recordings:
+            recording.call("getall", time.time() - starttime)
 
         return out
 
+    def preload(self, roles, packing=None):
+        # one bulk request per backend; later requests for these roles are served from memory
+        source = self if packing is None else packing.anchor(self)
+        self._preloading = True
+        try:
+            source.getall(list(roles))
+        finally:
+            self._preloading = False
+
     def close(self):
         for namespace, active in self._active.items():
             if hasattr(active, "close"):
                 active.close()
             self._active[namespace] = None
                 
+class PartitionCache(object):
+    def __init__(self, maxpartitions=1, maxbytes=None):
+        if maxpartitions < 1:
+            raise ValueError("maxpartitions must be at least 1")
+        self.maxpartitions = maxpartitions
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._partitions = OrderedDict()
+
+    def __repr__(self):
+        return "<PartitionCache {0}/{1} partitions {2} bytes hits={3} misses={4}>".format(len(self._partitions), self.maxpartitions, self.nbytes, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._partitions)
+
+    def __contains__(self, partitionid):
+        return partitionid in self._partitions
+
+    @property
+    def partitionids(self):
+        return list(self._partitions.keys())
+
+    @property
+    def nbytes(self):
+        return sum(self._nbytes(x) for x in self._partitions.values())
+
+    @staticmethod
+    def _nbytes(proxy):
+        return proxy._generator.loadedbytes(proxy._cache)
+
+    def get(self, partitionid, create):
+        if partitionid in self._partitions:
+            self.hits += 1
+            out = self._partitions[partitionid]
+            del self._partitions[partitionid]
+        else:
+            self.misses += 1
+            out = create(partitionid)
+
+        # arrays are loaded lazily, so the byte budget is checked against what earlier partitions have loaded by now
+        self._partitions[partitionid] = out
+        self._evict()
+        return out
+
+    def _evict(self):
+        while len(self._partitions) > self.maxpartitions:
+            del self._partitions[list(self._partitions.keys())[0]]
+
+        if self.maxbytes is not None:
+            sizes = [(n, self._nbytes(x)) for n, x in self._partitions.items()]
+            total = sum(size for n, size in sizes)
+            for n, size in sizes[:-1]:
+                if total <= self.maxbytes:
+                    break
+                del self._partitions[n]
+                total -= size
+
+    def clear(self):
+        self._partitions = OrderedDict()
+
+def _statcolumns(node):
+    # numeric primitives with at most one value per entry of a top-level list (reached through records only);
+    # works on schemas and generators alike
+    def recurse(path, chain, node):
+        if isinstance(node, oamap.generator.ExtendedGenerator):
+            node = node.generic
+        chain = chain + (node,)
+        if isinstance(node, (oamap.schema.Record, oamap.generator.RecordGenerator)):
+            for n, x in node.fields.items():
+                for y in recurse(path + (n,), chain, x):
+                    yield y
+        elif isinstance(node, (oamap.schema.Primitive, oamap.generator.PrimitiveGenerator)) and len(path) > 0 and node.dtype.shape == () and node.dtype.kind in "biuf":
+            yield "/".join(path), chain
+    return recurse((), (), node.content)
+
+def _statistics(data, namespaces=None):
+    out = {}
+    if not isinstance(data, oamap.proxy.ListProxy) or data._stride != 1:
+        return out
+
+    entries = numpy.arange(data._whence, data._whence + data._length)
+    for path, chain in _statcolumns(data._generator):
+        if namespaces is not None and chain[-1].namespace not in namespaces:
+            continue
+
+        index = entries
+        for generator in chain:
+            if isinstance(generator, oamap.generator.Masked):
+                mask = generator._getmask(data._arrays, data._cache)[index]
+                index = mask[mask != generator.maskedvalue]
+
+        values = chain[-1]._getdata(data._arrays, data._cache)[index]
+        if values.dtype.kind == "f":
+            isnan = numpy.isnan(values)
+            numnans = int(isnan.sum())
+            values = values[~isnan]
+        else:
+            numnans = 0
+
+        out[path] = {"count": len(entries),
+                     "nulls": len(entries) - len(index),
+                     "nans": numnans,
+                     "min": values.min().item() if len(values) > 0 else None,
+                     "max": values.max().item() if len(values) > 0 else None}
+    return out
+
+def _mergestatistics(partitions):
+    # per-partition dicts of {path: {stat: value}} -> {path: {stat: [value per partition]}}, for paths in all partitions
+    if len(partitions) == 0:
+        return {}
+    out = {}
+    for path in partitions[0]:
+        if all(path in x for x in partitions):
+            out[path] = dict((n, [x[path][n] for x in partitions]) for n in partitions[0][path])
+    return out
+
+def _inheritstatistics(oldschema, oldstats, newschema):
+    # statistics of columns that a new schema still reads, under the paths it reads them by
+    if oldstats is None:
+        return {}
+    # (only if the same masks are on the way to them: otherwise, the "nulls" would be different)
+    def masks(chain):
+        return tuple((x.namespace, x.mask) for x in chain if x.nullable)
+    old = dict(((chain[-1].namespace, chain[-1].data), (path, masks(chain))) for path, chain in _statcolumns(oldschema) if chain[-1].data is not None)
+    out = {}
+    for path, chain in _statcolumns(newschema):
+        oldpath, oldmasks = old.get((chain[-1].namespace, chain[-1].data), (None, None))
+        if chain[-1].data is not None and oldpath in oldstats and oldmasks == masks(chain):
+            out[path] = oldstats[oldpath]
+    return out
+
+def _concatcolumns(one, two):
+    if isinstance(one, tuple):
+        offsets = numpy.concatenate((one[0], two[0][1:] + one[0][-1]))
+        return offsets, _concatcolumns(one[1], two[1])
+    elif isinstance(one, numpy.ma.MaskedArray):
+        return numpy.ma.concatenate((one, two))
+    else:
+        return numpy.concatenate((one, two))
+
 class Dataset(_Data):
-    def __init__(self, name, schema, backends, executor, offsets, extension=None, packing=None, doc=None, metadata=None):
+    def __init__(self, name, schema, backends, executor, offsets, extension=None, packing=None, doc=None, metadata=None, stats=None):
         if not isinstance(schema, oamap.schema.List):
             raise TypeError("Dataset must have a list schema, not\n\n    {0}".format(schema.__repr__(indent="    ")))
 
@@ -306,7 +879,19 @@ class Dataset(_Data):
         if not numpy.all(offsets[:-1] <= offsets[1:]):
             raise ValueError("offsets must be monotonically increasing")
         self._offsets = offsets
-        self._cachedpartition = None
+        self._stats = stats
+        self._partitioncache = PartitionCache()
+        self._prefetch = 0
+        self._prefetching = {}
+        self._prefetchindexes = set()
+        self._prefetchpolicy = None
+        self._splitsize = None
+
+    def __getstate__(self):
+        # prefetching threads stay behind; cached partitions go along
+        state = self.__dict__.copy()
+        state["_prefetching"] = {}
+        return state
 
     def __repr__(self):
         return "<Dataset {0} {1} partitions {2} entries>{3}".format(repr(self._name), self.numpartitions, self.numentries, "".join(str(x) for x in self._operations))
@@ -338,26 +923,146 @@ class Dataset(_Data):
     def numentries(self):
         return int(self._offsets[-1])
 
-    def partition(self, partitionid):
-        if self._cachedpartition != partitionid:
-            self._cachedpartition = partitionid
+    @property
+    def stats(self):
+        return self._stats
 
-            if self._extension is None:
-                extension = oamap.util.import_module("oamap.extension.common")
-            elif isinstance(self._extension, basestring):
-                extension = oamap.util.import_module(self._extension)
-            else:
-                extension = [oamap.util.import_module(x) for x in self._extension]
+    @property
+    def partitioncache(self):
+        return self._partitioncache
 
-            self._cachedobject = self._schema(self.arrays(partitionid), extension=extension, packing=self._packing)
+    @partitioncache.setter
+    def partitioncache(self, value):
+        if not isinstance(value, PartitionCache):
+            raise TypeError("partitioncache must be a PartitionCache")
+        self._partitioncache = value
 
-        return self._cachedobject
+    @property
+    def prefetch(self):
+        return self._prefetch
+
+    @prefetch.setter
+    def prefetch(self, value):
+        if not isinstance(value, (numbers.Integral, numpy.integer)) or value < 0:
+            raise ValueError("prefetch must be a non-negative integer (number of partitions to load ahead)")
+        self._prefetch = int(value)
+
+    @property
+    def prefetchpolicy(self):
+        return self._prefetchpolicy
+
+    @prefetchpolicy.setter
+    def prefetchpolicy(self, value):
+        if value is not None and not isinstance(value, oamap.generator.PrefetchPolicy):
+            raise TypeError("prefetchpolicy must be None or an oamap.generator.PrefetchPolicy")
+        self._prefetchpolicy = value
+
+    @property
+    def splitsize(self):
+        return self._splitsize
+
+    @splitsize.setter
+    def splitsize(self, value):
+        if value is not None and (not isinstance(value, (numbers.Integral, numpy.integer)) or value <= 0):
+            raise ValueError("splitsize must be None or a positive integer (maximum number of entries per task)")
+        self._splitsize = None if value is None else int(value)
+
+    def partition(self, partitionid):
+        if self._prefetch > 0 and partitionid not in self._partitioncache and not isinstance(self._executor, MultiprocessExecutor):
+            # columns that were used in partitions already seen are the ones to load ahead of time
+            for proxy in self._partitioncache._partitions.values():
+                self._prefetchindexes.update(i for i, x in enumerate(proxy._cache) if x is not None)
+            out = self._partitioncache.get(partitionid, self._newpartition)
+            # within an operation chain, the arrays it plans to read are the ones to load ahead of time
+            self._startprefetch(partitionid, self._plan(out) if len(self._operations) > 0 else [])
+            return out
+        else:
+            return self._partitioncache.get(partitionid, self._newpartition)
+
+    def _newpartition(self, partitionid):
+        prefetching = self._prefetching.pop(partitionid, None)
+        if prefetching is not None:
+            thread, result = prefetching
+            thread.join()
+            if len(result) > 0:
+                return result[0]
+
+        return self._makepartition(partitionid)
+
+    def _makepartition(self, partitionid):
+        if self._extension is None:
+            extension = oamap.util.import_module("oamap.extension.common")
+        elif isinstance(self._extension, basestring):
+            extension = oamap.util.import_module(self._extension)
+        else:
+            extension = [oamap.util.import_module(x) for x in self._extension]
+
+        return self._schema(self.arrays(partitionid), extension=extension, packing=self._packing, prefetch=self._prefetchpolicy)
+
+    def _startprefetch(self, partitionid, roles):
+        ahead = range(partitionid + 1, min(partitionid + 1 + self._prefetch, self.numpartitions))
+        for n in list(self._prefetching):
+            if n not in ahead:
+                del self._prefetching[n]
+
+        indexes = frozenset(self._prefetchindexes)
+        for n in ahead:
+            if n not in self._prefetching and n not in self._partitioncache:
+                result = []
+                thread = threading.Thread(target=self._prefetchpartition, args=(n, indexes, roles, result))
+                thread.daemon = True
+                self._prefetching[n] = (thread, result)
+                thread.start()
+
+    def _prefetchpartition(self, partitionid, indexes, roles, result):
+        try:
+            out = self._makepartition(partitionid)
+            generator = out._generator
+            if len(roles) > 0 and isinstance(out._arrays, DataArrays):
+                out._arrays.preload(roles, generator.packing)
+            else:
+                generator._getarrays(out._arrays, out._cache, generator._togetindexes(out._arrays, out._cache, indexes))
+        except Exception:
+            pass    # errors surface when the partition is loaded in the foreground
+        else:
+            result.append(out)
 
     def __iter__(self):
         for partitionid in range(self.numpartitions):
             for i in range(self._offsets[partitionid], self._offsets[partitionid + 1]):
                 yield self[i]
 
+    def iterbatches(self, size, columns=None):
+        if not isinstance(size, (numbers.Integral, numpy.integer)) or size <= 0:
+            raise ValueError("size must be a positive integer (number of entries per batch)")
+
+        # batches straddling a partition boundary are stitched together from both partitions
+        pending = None
+        for partitionid in range(self.numpartitions):
+            whole = self.partition(partitionid)
+            if columns is None:
+                columns = oamap.proxy._columnpaths(whole._generator.content)
+
+            start = 0
+            if pending is not None:
+                start = min(size - pendinglen, len(whole))
+                pending = oamap.util.OrderedDict((n, _concatcolumns(x, y)) for (n, x), y in zip(pending.items(), whole[:start]._batch(columns).values()))
+                pendinglen += start
+                if pendinglen < size:
+                    continue
+                yield pending
+                pending = None
+
+            for batchstart in range(start, len(whole), size):
+                batch = whole[batchstart : batchstart + size]
+                if len(batch) == size:
+                    yield batch._batch(columns)
+                else:
+                    pending, pendinglen = batch._batch(columns), len(batch)
+
+        if pending is not None:
+            yield pending
+
     def __getitem__(self, index):
         if isinstance(index, slice):
             start, stop, step = oamap.util.slice2sss(index, self.numentries)
@@ -367,14 +1072,11 @@ class Dataset(_Data):
             if localstop < -1 or localstop > (self._offsets[partitionid + 1] - self._offsets[partitionid]):
                 raise IndexError("slice spans multiple partitions")
 
-            out = self.partition(partitionid)
-            out._whence = localstart
-            out._stride = step
+            whole = self.partition(partitionid)
 
             # out._length = int(math.ceil(float(abs(localstop - localstart)) / abs(step)))
             d, m = divmod(abs(localstart - localstop), abs(step))
-            out._length = d + (1 if m != 0 else 0)
-            return out
+            return oamap.proxy.ListProxy(whole._generator, whole._arrays, whole._cache, localstart, step, d + (1 if m != 0 else 0))
 
         else:
             normindex = index if index >= 0 else index + self.numentries
@@ -401,14 +1103,18 @@ class Dataset(_Data):
             for operation in self._operations:
                 result = operation.apply(result)
             if isinstance(result, oamap.proxy.ListProxy):
-                out = Dataset(name, result._generator.schema, self._backends, self._executor, self._offsets, extension=self._extension, packing=None, doc=self._doc, metadata=self._metadata)
+                stats = _inheritstatistics(self._schema, self._stats, result._generator.namedschema())
+                out = Dataset(name, result._generator.schema, self._backends, self._executor, self._offsets, extension=self._extension, packing=None, doc=self._doc, metadata=self._metadata, stats=stats if len(stats) > 0 else None)
             else:
                 out = Data(name, result._generator.schema, self._backends, self._executor, extension=self._extension, packing=None, doc=self._doc, metadata=self._metadata)
             return [SingleThreadExecutor.PseudoFuture(update(out))]
 
         else:
+            self._checkwritable(namespace)
+
             def task(name, dataset, namespace, partitionid):
-                result = dataset.partition(partitionid)
+                result = data = dataset.partition(partitionid)
+                dataset._preload(data)
                 for operation in dataset._operations:
                     result = operation.apply(result)
 
@@ -421,23 +1127,28 @@ class Dataset(_Data):
                 else:
                     for n, x in roles2arrays.items():
                         active[str(n)] = x
+                dataset._unpreload(data)
                 if isinstance(result, oamap.proxy.ListProxy):
-                    return schema, len(result)
+                    # statistics of the newly computed columns (the others are inherited if the entries are unchanged)
+                    return schema, len(result), _statistics(result, set(result._generator.namespaces()).difference(dataset._backends))
                 else:
-                    return schema, 1
+                    return schema, 1, {}
 
             tasks = [self._executor.submit(task, name, self, namespace, i) for i in range(self.numpartitions)]
 
             def collect(name, dataset, results, update):
-                if isinstance(results[0], tuple) and len(results[0]) == 2 and isinstance(results[0][0], oamap.schema.Schema):
-                    offsets = numpy.cumsum([0] + [numentries for schema, numentries in results], dtype=numpy.int64)
-                    schema = results[0][0]
-                else:
-                    offsets = numpy.cumsum([0] + [x.result()[1] for x in results], dtype=numpy.int64)
-                    schema = results[0].result()[0]
+                if not (isinstance(results[0], tuple) and len(results[0]) == 3 and isinstance(results[0][0], oamap.schema.Schema)):
+                    results = [x.result() for x in results]
+                offsets = numpy.cumsum([0] + [numentries for schema, numentries, stats in results], dtype=numpy.int64)
+                schema = results[0][0]
 
                 if isinstance(schema, oamap.schema.List):
-                    out = Dataset(name, schema, dataset._backends, dataset._executor, offsets, extension=dataset._extension, packing=None, doc=dataset._doc, metadata=dataset._metadata)
+                    stats = _mergestatistics([stats for schema, numentries, stats in results])
+                    if numpy.array_equal(offsets, dataset._offsets):
+                        inherited = _inheritstatistics(dataset._schema, dataset._stats, schema)
+                        inherited.update(stats)
+                        stats = inherited
+                    out = Dataset(name, schema, dataset._backends, dataset._executor, offsets, extension=dataset._extension, packing=None, doc=dataset._doc, metadata=dataset._metadata, stats=stats if len(stats) > 0 else None)
                 else:
                     out = Data(name, schema, dataset._backends, dataset._executor, extension=dataset._extension, packing=None, doc=dataset._doc, metadata=dataset._metadata)
                 return update(out)
@@ -446,13 +1157,138 @@ class Dataset(_Data):
             return tasks
 
     def act(self, combiner):
-        def task(dataset, partitionid):
-            result = dataset.partition(partitionid)
-            for operation in dataset._operations:
-                result = operation.apply(result)
+        def task(dataset, partitionid, start, stop, shared):
+            if shared is None:
+                result = data = dataset.partition(partitionid)
+                dataset._preload(data)
+            else:
+                result = shared.acquire()[start:stop]
+            try:
+                for operation in dataset._operations:
+                    result = operation.apply(result)
+            finally:
+                if shared is None:
+                    dataset._unpreload(data)
+                else:
+                    shared.release()
             return result
 
-        return combiner([self._executor.submit(task, self, i) for i in range(self.numpartitions)])
+        fused = self._fused()
+        action = self._operations[-1]
+        empty = getattr(action.function, "empty", None)
+        if action.name in oamap.operations.prunable or empty is not None:
+            pruned = self._pruned()
+        else:
+            pruned = set()
+        pieces = fused._pieces()
+        if action.name in oamap.operations.prunable:
+            pieces = [x for x in pieces if x[0] not in pruned] or pieces[:1]
+            pruned = set()
+
+        shared = {}
+        for partitionid, start, stop, numentries in pieces:
+            if start is not None and partitionid not in pruned:
+                if partitionid not in shared:
+                    shared[partitionid] = _SplitPartition(fused, partitionid)
+                shared[partitionid].remaining += 1
+
+        # largest pieces first so that stragglers are small; each worker takes the next piece when it finishes one
+        submit, recording = _recordedsubmit(self._executor)
+        futures = [None] * len(pieces)
+        for i in sorted(range(len(pieces)), key=lambda i: (-pieces[i][3], i)):
+            if pieces[i][0] in pruned:
+                futures[i] = SingleThreadExecutor.PseudoFuture(empty(*action.args, **action.kwargs))
+            else:
+                futures[i] = submit(task, fused, pieces[i][0], pieces[i][1], pieces[i][2], shared.get(pieces[i][0]))
+
+        sizes = fused._sizebounds(pieces)
+        if sizes is not None and "sizes" in oamap.util.argnames(combiner):
+            return _withrecording(combiner(futures, sizes=sizes), recording)
+        else:
+            return _withrecording(combiner(futures), recording)
+
+    def _pieces(self):
+        out = []
+        for partitionid in range(self.numpartitions):
+            numentries = int(self._offsets[partitionid + 1] - self._offsets[partitionid])
+            if self._splitsize is None or numentries <= self._splitsize or not self._splittable():
+                out.append((partitionid, None, None, numentries))
+            else:
+                # the pieces of one partition share its arrays (see _SplitPartition)
+                numpieces = -(-numentries // self._splitsize)
+                bounds = [(numentries * i) // numpieces for i in range(numpieces + 1)]
+                for start, stop in zip(bounds[:-1], bounds[1:]):
+                    out.append((partitionid, start, stop, stop - start))
+        return out
+
+    def _pruned(self):
+        # partitions that the statistics prove cannot pass the leading filters
+        out = set()
+        if self._stats is None:
+            return out
+        for operation in self._operations:
+            if operation.name in ("keep", "drop"):
+                continue
+            prune = getattr(operation.function, "prune", None)
+            if prune is None:
+                break
+            out.update(prune(self._stats, *operation.args, **operation.kwargs))
+        return out
+
+    def _splittable(self):
+        for operation in self._operations:
+            if operation.name not in oamap.operations.sliceable:
+                return False
+            if operation.name not in oamap.operations.recastings and inspect.getcallargs(operation.function, None, *operation.args, **operation.kwargs)["at"] != "":
+                return False
+        return True
+
+    def _sizebounds(self, pieces=None):
+        # a map over the top-level list returns at most one row per entry, if nothing before it changed the top-level list
+        action = self._operations[-1]
+        if action.name != "map" or inspect.getcallargs(action.function, None, *action.args, **action.kwargs)["at"] != "":
+            return None
+        if not all(x.name in oamap.operations.boundedlength for x in self._operations[:-1]):
+            return None
+        if pieces is None:
+            return (self._offsets[1:] - self._offsets[:-1]).tolist()
+        else:
+            return [x[3] for x in pieces]
+
+class _SplitPartition(object):
+    # the pieces of a split partition read through one proxy whose arrays are held (loaded once) until the last piece finishes;
+    # in worker processes (MultiprocessExecutor), each piece has its own copy and loads its own arrays
+    def __init__(self, dataset, partitionid):
+        self.dataset = dataset
+        self.partitionid = partitionid
+        self.remaining = 0
+        self._lock = threading.Lock()
+        self._data = None
+
+    def __getstate__(self):
+        return (self.dataset, self.partitionid)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+        self.remaining = 1
+
+    def acquire(self):
+        with self._lock:
+            if self._data is None:
+                self._data = self.dataset.partition(self.partitionid)
+                if isinstance(self._data._arrays, DataArrays):
+                    self._data._arrays._holding = True
+                self.dataset._preload(self._data)
+            return self._data
+
+    def release(self):
+        with self._lock:
+            self.remaining -= 1
+            if self.remaining == 0 and self._data is not None:
+                if isinstance(self._data._arrays, DataArrays):
+                    self._data._arrays._holding = False
+                self.dataset._unpreload(self._data)
+                self._data = None
 
 class DatasetArrays(DataArrays):
     def __init__(self, partitionid, startsrole, stopsrole, numentries, backends):
@@ -30,11 +30,15 @@
 
 import sys
 import datetime
+import json
 import os
+import time
+import weakref
 
 import numpy
 
 import oamap.proxy
+import oamap.util
 from oamap.util import OrderedDict
 
 if sys.version_info[0] > 2:
@@ -105,6 +109,247 @@ class OffsetsRole(Role):
 
 class PositionsRole(Role): pass
 
+# loaded arrays, indexed by the generators' *idx; pickles pass large arrays by name, to be mapped without copying
+class Cache(list):
+    def __init__(self, length):
+        super(Cache, self).__init__([None] * length)
+        self.prefetch = None
+        self._prefetchstate = None
+        self.version = 0
+        self._tables = None
+
+    def __setitem__(self, idx, value):
+        super(Cache, self).__setitem__(idx, value)
+        self.version += 1
+
+    def __reduce__(self):
+        return (self.__class__, (len(self),), self.__getstate__())
+
+    def __getstate__(self):
+        return ([oamap.util.sharedref(x) for x in self], self.prefetch, self._prefetchstate)
+
+    def __setstate__(self, state):
+        arrays, self.prefetch, self._prefetchstate = state
+        for i, x in enumerate(arrays):
+            self[i] = oamap.util.attachref(x)
+
+# cache of loaded arrays that forgets the least recently used ones beyond limitbytes (they're reloaded when needed)
+class ArrayCache(Cache):
+    def __init__(self, length, limitbytes=None):
+        super(ArrayCache, self).__init__(length)
+        self.limitbytes = limitbytes
+        self.nbytes = 0
+        self.evictions = 0
+        self._sizes = [0] * length
+        self._lastuse = [0] * length
+        self._pins = [0] * length
+        self._pinners = {}
+        self._clock = 0
+        self._held = 0
+
+    def __repr__(self):
+        return "<ArrayCache {0} of {1} arrays, {2} bytes>".format(sum(1 for x in self if x is not None), len(self), self.nbytes)
+
+    def __getitem__(self, idx):
+        out = super(ArrayCache, self).__getitem__(idx)
+        if out is not None:
+            self._clock += 1
+            self._lastuse[idx] = self._clock
+        return out
+
+    def __setitem__(self, idx, value):
+        super(ArrayCache, self).__setitem__(idx, value)
+        self.nbytes -= self._sizes[idx]
+        self._sizes[idx] = getattr(value, "nbytes", 0)
+        self.nbytes += self._sizes[idx]
+        self._clock += 1
+        self._lastuse[idx] = self._clock
+
+    def __getstate__(self):
+        return (super(ArrayCache, self).__getstate__(), self.limitbytes)
+
+    def __setstate__(self, state):
+        arrays, self.limitbytes = state
+        super(ArrayCache, self).__setstate__(arrays)
+
+    def pinned(self):
+        return [i for i, x in enumerate(self._pins) if x > 0]
+
+    def pin(self, indexes, owner):
+        indexes = list(indexes)
+        for i in indexes:
+            self._pins[i] += 1
+        def unpin(ref):
+            if not hasattr(self, "_pinners"):
+                return                                                 # the cache itself is being torn down
+            del self._pinners[id(ref)]
+            for i in indexes:
+                self._pins[i] -= 1
+            self.evict()
+        ref = weakref.ref(owner, unpin)
+        self._pinners[id(ref)] = ref
+
+    def evict(self, protect=()):
+        if self.limitbytes is None or self._held > 0 or self.nbytes <= self.limitbytes:
+            return
+        # the cached pointer table pins its arrays; let it go so that only tables in use by compiled code still pin
+        self._tables = None
+        for lastuse, i in sorted((self._lastuse[i], i) for i in range(len(self)) if self._sizes[i] > 0 and self._pins[i] == 0 and i not in protect):
+            if self.nbytes <= self.limitbytes:
+                break
+            self[i] = None
+            self.evictions += 1
+
+    def bypath(self, generator):
+        out = OrderedDict()
+        def recurse(generator, path, memo):
+            if id(generator) in memo:
+                return
+            memo.add(id(generator))
+            if isinstance(generator, ExtendedGenerator):
+                generator = generator.generic
+            nbytes = sum(self._sizes[idx] for idx, dtype in generator._toget(None, self).values())
+            out[path] = out.get(path, 0) + nbytes
+            if isinstance(generator, ListGenerator):
+                recurse(generator.content, path, memo)
+            elif isinstance(generator, UnionGenerator):
+                for x in generator.possibilities:
+                    recurse(x, path, memo)
+            elif isinstance(generator, RecordGenerator):
+                for n, x in generator.fields.items():
+                    recurse(x, n if path == "" else path + "/" + n, memo)
+            elif isinstance(generator, TupleGenerator):
+                for i, x in enumerate(generator.types):
+                    recurse(x, str(i) if path == "" else path + "/" + str(i), memo)
+            elif isinstance(generator, PointerGenerator):
+                recurse(generator.target, path, memo)
+        recurse(generator, "", set())
+        return out
+
+################################################################ prefetch policies
+
+# a policy names the generators whose arrays are fetched along with a requested generator's, in the same backend call;
+# generators are shared among proxies (see oamap.schema.generatorcachesize), so the policy's state lives in the cache
+class PrefetchPolicy(object):
+    def start(self, root):
+        return None
+
+    def companions(self, generator, state):
+        return ()
+
+    def observe(self, roles, state):
+        pass
+
+def _reachable(generator, through):
+    out = []
+    stack = [generator]
+    seen = set()
+    while len(stack) > 0:
+        generator = stack.pop()
+        if id(generator) in seen:
+            continue
+        seen.add(id(generator))
+        out.append(generator)
+        if isinstance(generator, ExtendedGenerator):
+            stack.extend(_reachable(generator.generic, (ListGenerator, UnionGenerator)))
+        elif isinstance(generator, RecordGenerator):
+            stack.extend(generator.fields.values())
+        elif isinstance(generator, TupleGenerator):
+            stack.extend(generator.types)
+        elif isinstance(generator, ListGenerator) and ListGenerator in through:
+            stack.append(generator.content)
+        elif isinstance(generator, UnionGenerator) and UnionGenerator in through:
+            stack.extend(generator.possibilities)
+    return out
+
+class PrefetchRecord(PrefetchPolicy):
+    # touching one field fetches all fields of the same record (and nested records, but not the contents of lists)
+    def start(self, root):
+        out = {}
+        for generator in root.generators():
+            if isinstance(generator, (RecordGenerator, TupleGenerator)) and generator.id not in out:
+                members = _reachable(generator, ())
+                for x in members:
+                    out[x.id] = members
+        return out
+
+    def companions(self, generator, state):
+        return state.get(generator.id, ())
+
+class PrefetchList(PrefetchPolicy):
+    # touching anything inside a list's contents fetches everything inside the innermost enclosing list's contents
+    def start(self, root):
+        out = {}
+        for generator in root.generators():
+            if isinstance(generator, ListGenerator):
+                members = _reachable(generator.content, (ListGenerator, UnionGenerator))
+                for x in members:
+                    out[x.id] = members
+        return out
+
+    def companions(self, generator, state):
+        return state.get(generator.id, ())
+
+class PrefetchLearned(PrefetchPolicy):
+    # each cache is a session: arrays read in at least a threshold fraction of earlier sessions are fetched with the first read
+    def __init__(self, threshold=0.5, sessions=0, counts=None):
+        self.threshold = threshold
+        self.sessions = sessions
+        self.counts = {} if counts is None else dict(counts)
+
+    def __repr__(self):
+        return "PrefetchLearned({0}, {1}, <{2} arrays>)".format(self.threshold, self.sessions, len(self.counts))
+
+    def start(self, root):
+        frequent = []
+        if self.sessions > 0:
+            for generator in root.generators():
+                if any(self.counts.get(str(role), 0) >= self.threshold * self.sessions for role in generator._toget(None, None)):
+                    frequent.append(generator)
+        self.sessions += 1
+        return {"frequent": frequent, "seen": set()}
+
+    def companions(self, generator, state):
+        return state["frequent"]
+
+    def observe(self, roles, state):
+        for role in roles:
+            name = str(role)
+            if name not in state["seen"]:
+                state["seen"].add(name)
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def tojson(self):
+        return {"threshold": self.threshold, "sessions": self.sessions, "counts": self.counts}
+
+    @staticmethod
+    def fromjson(data):
+        return PrefetchLearned(data["threshold"], data["sessions"], data["counts"])
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump(self.tojson(), file)
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            return PrefetchLearned.fromjson(json.load(file))
+
+################################################################ dtype conversions
+
+# converted copies are memoized per source array (oamap.util.derived), so reloading an evicted array doesn't convert it again while the copy is still in use
+def _convertarray(array, dtype, exclusive):
+    # exclusive means that nothing else can see the array's buffer, so a change of byte order can be done in place
+    if exclusive and type(array) is numpy.ndarray and array.dtype.fields is None and array.dtype.newbyteorder("S") == dtype and array.flags.writeable and (array.flags.owndata or (type(array.base) is numpy.ndarray and array.base.flags.owndata)):
+        return array.byteswap(True).view(dtype), False
+
+    built = []
+    def build(array):
+        built.append(True)
+        return numpy.array(array, dtype=dtype)
+
+    return oamap.util.derived(array, ("dtype", dtype), build), len(built) > 0
+
 # base class of all runtime-object generators (one for each type)
 class Generator(object):
     _starttime = datetime.datetime.now().isoformat()
@@ -139,10 +384,24 @@ class Generator(object):
         import oamap.fill
         return self(oamap.fill.fromiterdata(values, generator=self, limit=limit, pointer_fromequal=pointer_fromequal))
 
-    def __call__(self, arrays):
-        return self._generate(arrays, 0, self._newcache())
+    def __call__(self, arrays, limitbytes=None, prefetch=None):
+        return self._generate(arrays, 0, self._newcache(limitbytes, prefetch))
 
     def _getarrays(self, arrays, cache, roles, require_arrays=False):
+        prefetch = getattr(cache, "prefetch", None)
+        if prefetch is not None:
+            prefetch.observe(roles, cache._prefetchstate)              # only what was asked for, not what the policy added
+            roles = OrderedDict(roles)
+            for generator in prefetch.companions(self, cache._prefetchstate):
+                if generator is not self and generator.packing == self.packing:
+                    for role, (idx, dtype) in generator._toget(arrays, cache).items():
+                        if role not in roles and cache[idx] is None:
+                            roles[role] = (idx, dtype)
+
+        recordings = oamap.util.activerecordings()
+        if len(recordings) > 0:
+            starttime = time.time()
+
         if self.packing is not None:
             arrays = self.packing.anchor(arrays)
 
@@ -151,19 +410,48 @@ class Generator(object):
         else:
             out = dict((name, arrays[str(name)]) for name in roles)    # drop the roles; it's a plain-dict interface
 
-        for name, array in out.items():
+        if len(recordings) > 0:
+            # the fetch time is shared evenly among the roles fetched together
+            share = (time.time() - starttime) / max(1, len(out))
+
+        for name in list(out):
+            array = out.pop(name)                                      # so that the only references to a fresh array are ours
             idx, dtype = roles[name]
 
             if isinstance(array, bytes):
                 array = numpy.frombuffer(array, dtype)
 
-            if (require_arrays and not isinstance(array, numpy.ndarray)) or getattr(array, "dtype", dtype) != dtype:
+            converted = False
+            if isinstance(array, numpy.ndarray) and array.dtype != dtype:
+                exclusive = hasattr(sys, "getrefcount") and sys.getrefcount(array) <= 2 and (array.base is None or sys.getrefcount(array.base) <= 2)
+                array, converted = _convertarray(array, dtype, exclusive)
+            elif (require_arrays and not isinstance(array, numpy.ndarray)) or getattr(array, "dtype", dtype) != dtype:
                 array = numpy.array(array, dtype=dtype)
+                converted = True
 
             cache[idx] = array
 
-    def _newcache(self):
-        return [None] * self._cachelen
+            if len(recordings) > 0:
+                nbytes = getattr(array, "nbytes", 0)
+                for recording in recordings:
+                    recording.role(str(name), 1, nbytes, int(converted), nbytes if converted else 0, share)
+
+        if len(recordings) > 0:
+            for recording in recordings:
+                recording.call("getarrays", time.time() - starttime)
+
+        if isinstance(cache, ArrayCache):
+            cache.evict(protect=set(idx for idx, dtype in roles.values()))
+
+    def _newcache(self, limitbytes=None, prefetch=None):
+        if limitbytes is None:
+            out = Cache(self._cachelen)
+        else:
+            out = ArrayCache(self._cachelen, limitbytes)
+        if prefetch is not None:
+            out.prefetch = prefetch
+            out._prefetchstate = prefetch.start(self)
+        return out
 
     def _clearcache(self, cache, listofarrays, index):
         if 0 <= index < len(listofarrays):
@@ -174,17 +462,59 @@ class Generator(object):
             cache[i] = None
 
     def _entercompiled(self, arrays, cache, bottomup=True):
-        roles = self._togetall(arrays, cache, bottomup, set())
-        self._getarrays(arrays, cache, roles, require_arrays=True)
+        recordings = oamap.util.activerecordings()
+        if len(recordings) > 0:
+            starttime = time.time()
+
+        # the pointer table is reused until a slot of the cache changes
+        tables = getattr(cache, "_tables", None)
+        if tables is not None and tables[0] == cache.version and tables[1] is self and tables[2] is arrays and tables[3] == bottomup:
+            for recording in recordings:
+                recording.call("entercompiled", time.time() - starttime)
+            return tables[4]
+
+        if isinstance(cache, ArrayCache):
+            cache._held += 1
+        try:
+            roles = self._togetall(arrays, cache, bottomup, set())
+            self._getarrays(arrays, cache, roles, require_arrays=True)
+
+            ptrs = numpy.zeros(self._cachelen, dtype=numpy.intp)
+            lens = numpy.zeros(self._cachelen, dtype=numpy.intp)
+            for i, x in enumerate(cache):
+                if x is not None:
+                    ptrs[i] = x.ctypes.data
+                    lens[i] = x.shape[0]
+
+        finally:
+            if isinstance(cache, ArrayCache):
+                cache._held -= 1
+
+        if isinstance(cache, ArrayCache):
+            # arrays stay in the cache for as long as compiled code holds the pointer table
+            cache.pin([i for i, x in enumerate(cache) if x is not None], ptrs)
+            cache.evict()
+
+        out = (ptrs, lens, ptrs.ctypes.data, lens.ctypes.data)
+        if isinstance(cache, Cache):
+            cache._tables = (cache.version, self, arrays, bottomup, out)
+
+        for recording in recordings:
+            recording.call("entercompiled", time.time() - starttime)
 
-        ptrs = numpy.zeros(self._cachelen, dtype=numpy.intp)
-        lens = numpy.zeros(self._cachelen, dtype=numpy.intp)
-        for i, x in enumerate(cache):
-            if x is not None:
-                ptrs[i] = x.ctypes.data
-                lens[i] = x.shape[0]
+        return out
 
-        return ptrs, lens, ptrs.ctypes.data, lens.ctypes.data
+    def _togetindexes(self, arrays, cache, indexes):
+        out = OrderedDict()
+        for generator in self.generators():
+            for role, (idx, dtype) in generator._toget(arrays, cache).items():
+                if idx in indexes and cache[idx] is None:
+                    out[role] = (idx, dtype)
+        return out
+
+    def loadedbytes(self, cache):
+        name2idx = dict(self.iternames(idx=True))
+        return sum(getattr(cache[name2idx[name]], "nbytes", 0) for name in self.loaded(cache))
 
     def names(self, namespace=False, idx=False):
         return list(self.iternames(namespace=namespace, idx=idx))
@@ -339,6 +669,13 @@ class PrimitiveGenerator(Generator):
             if cache[self.dataidx] is not None:
                 yield self.data
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -423,11 +760,11 @@ class ListGenerator(Generator):
                 stops = numpy.array(stops, dtype=self.posdtype)
         return starts, stops
 
-    def __call__(self, arrays, numentries=None):
+    def __call__(self, arrays, numentries=None, limitbytes=None, prefetch=None):
         if isinstance(self, Masked):
-            return self._generate(arrays, 0, self._newcache())
+            return self._generate(arrays, 0, self._newcache(limitbytes, prefetch))
         else:
-            return self._generate(arrays, 0, self._newcache(), numentries=numentries)
+            return self._generate(arrays, 0, self._newcache(limitbytes, prefetch), numentries=numentries)
 
     def _generate(self, arrays, index, cache, numentries=None):
         if numentries is None:
@@ -474,6 +811,15 @@ class ListGenerator(Generator):
             for x in self.content.loaded(cache, memo):
                 yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for x in self.content.generators(memo):
+                yield x
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -611,6 +957,16 @@ class UnionGenerator(Generator):
                 for x in possibility.loaded(cache, memo):
                     yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for possibility in self.possibilities:
+                for x in possibility.generators(memo):
+                    yield x
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -653,8 +1009,25 @@ class MaskedUnionGenerator(Masked, UnionGenerator):
 class RecordGenerator(Generator):
     def __init__(self, fields, namespace, packing, name, derivedname, schema):
         self.fields = fields
+        self._proxyclass = oamap.proxy.RecordProxy
         Generator.__init__(self, namespace, packing, name, derivedname, schema)
 
+    def _specialize(self):
+        self._proxyclass = oamap.proxy._specializedrecord(self)
+
+    def __getstate__(self):
+        # specialized proxy classes are made at runtime, so they are remade after unpickling
+        out = self.__dict__.copy()
+        out["_proxyclass"] = self._proxyclass is not oamap.proxy.RecordProxy
+        return out
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._proxyclass is True:
+            self._specialize()
+        else:
+            self._proxyclass = oamap.proxy.RecordProxy
+
     def _new(self, memo=None):
         if memo is None:
             memo = set()
@@ -678,7 +1051,7 @@ class RecordGenerator(Generator):
             return OrderedDict()
 
     def _generate(self, arrays, index, cache):
-        return oamap.proxy.RecordProxy(self, arrays, cache, index)
+        return self._proxyclass(self, arrays, cache, index)
 
     def _requireall(self, memo=None):
         if memo is None:
@@ -703,6 +1076,16 @@ class RecordGenerator(Generator):
                 for x in field.loaded(cache, memo):
                     yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for field in self.fields.values():
+                for x in field.generators(memo):
+                    yield x
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -793,6 +1176,16 @@ class TupleGenerator(Generator):
                 for x in field.loaded(cache, memo):
                     yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for field in self.types:
+                for x in field.generators(memo):
+                    yield x
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -908,6 +1301,15 @@ class PointerGenerator(Generator):
             for x in self.target.loaded(cache, memo):
                 yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for x in self.target.generators(memo):
+                yield x
+
     def required(self, memo=None):
         if memo is None:
             memo = set()
@@ -1002,6 +1404,15 @@ class ExtendedGenerator(Generator):
         for x in self.generic.loaded(cache, memo):
             yield x
 
+    def generators(self, memo=None):
+        if memo is None:
+            memo = set()
+        if id(self) not in memo:
+            memo.add(id(self))
+            yield self
+            for x in self.generic.generators(memo):
+                yield x
+
     def required(self, memo=None):
         for x in self.generic.required(memo):
             yield x
@@ -43,6 +43,9 @@ import oamap.proxy
 import oamap.util
 import oamap.compiler
 
+if sys.version_info[0] > 2:
+    basestring = str
+
 recastings      = oamap.util.OrderedDict()
 transformations = oamap.util.OrderedDict()
 actions         = oamap.util.OrderedDict()
@@ -68,6 +71,155 @@ def _setindexes(input, output):
 
     return output
     
+################################################################ planning which arrays an operation reads
+
+def _fcnnames(fcn):
+    # attribute and global names the function (and functions it calls) could read; None if unknown
+    fcn = getattr(fcn, "py_func", fcn)
+    if not hasattr(fcn, "__code__"):
+        return None
+
+    out = set()
+    def recurse(code, globs, memo):
+        if id(code) not in memo:
+            memo.add(id(code))
+            out.update(code.co_names)
+            for x in code.co_consts:
+                if isinstance(x, types.CodeType):
+                    recurse(x, globs, memo)
+            for n in code.co_names:
+                x = getattr(globs.get(n, None), "py_func", globs.get(n, None))
+                if isinstance(x, types.FunctionType):
+                    recurse(x.__code__, x.__globals__, memo)
+
+    recurse(fcn.__code__, fcn.__globals__, set())
+    for cell in fcn.__closure__ or ():
+        try:
+            x = getattr(cell.cell_contents, "py_func", cell.cell_contents)
+        except ValueError:
+            continue
+        if isinstance(x, types.FunctionType):
+            out.update(_fcnnames(x))
+    return out
+
+def _pathnodes(schema, at):
+    return list(schema.path(at, parents=True))
+
+def _fcnnodes(schema, fcn, at):
+    # nodes on the way to "at" and everything beneath it, dropping record fields the function never names
+    names = _fcnnames(fcn)
+    out = _pathnodes(schema, at)
+    def recurse(node, memo):
+        if id(node) not in memo:
+            memo.add(id(node))
+            out.append(node)
+            if isinstance(node, oamap.schema.Record):
+                for n, x in node.fields.items():
+                    if names is None or n in names:
+                        recurse(x, memo)
+            elif isinstance(node, oamap.schema.List):
+                recurse(node.content, memo)
+            elif isinstance(node, oamap.schema.Union):
+                for x in node.possibilities:
+                    recurse(x, memo)
+            elif isinstance(node, oamap.schema.Tuple):
+                for x in node.types:
+                    recurse(x, memo)
+            elif isinstance(node, oamap.schema.Pointer):
+                recurse(node.target, memo)
+    recurse(out[0], set())
+    return out
+
+def _noderoles(nodes):
+    out = oamap.util.OrderedDict()
+    for node in nodes:
+        roles = []
+        if isinstance(node, oamap.schema.Primitive):
+            roles.append(oamap.generator.DataRole(node.data, node.namespace))
+        elif isinstance(node, oamap.schema.List):
+            starts = oamap.generator.StartsRole(node.starts, node.namespace, None)
+            stops = oamap.generator.StopsRole(node.stops, node.namespace, None)
+            starts.stops = stops
+            stops.starts = starts
+            roles.extend([starts, stops])
+        elif isinstance(node, oamap.schema.Union):
+            tags = oamap.generator.TagsRole(node.tags, node.namespace, None)
+            offsets = oamap.generator.OffsetsRole(node.offsets, node.namespace, None)
+            tags.offsets = offsets
+            offsets.tags = tags
+            roles.extend([tags, offsets])
+        elif isinstance(node, oamap.schema.Pointer):
+            roles.append(oamap.generator.PositionsRole(node.positions, node.namespace))
+        if node.nullable:
+            roles.insert(0, oamap.generator.MaskRole(node.mask, node.namespace, dict((x, None) for x in roles)))
+        for x in roles:
+            out[x] = None
+    return list(out)
+
+################################################################ fusing filters into the action that follows them
+
+def _fusepredicates(predicates, fcn, args, numfixed, failed, numba):
+    # one function applies each predicate and then fcn, so that a filter-then-action chain is one pass with no pointers arrays
+    if not isinstance(args, tuple):
+        try:
+            args = tuple(args)
+        except TypeError:
+            args = (args,)
+
+    fixed = ["datum", "tally"][:numfixed]
+    avoid = set(fixed)
+    env = {}
+    params = []
+    conditions = []
+    for predicate, predargs in predicates:
+        name = oamap.util.varname(avoid, "predicate")
+        env[name] = oamap.util.trycompile(predicate, numba=numba)
+        names = [oamap.util.varname(avoid, "arg") for x in predargs]
+        params.extend(names)
+        conditions.append("{0}({1})".format(name, ", ".join([fixed[0]] + names)))
+
+    fcnname = oamap.util.varname(avoid, "fcn")
+    env[fcnname] = oamap.util.trycompile(fcn, numba=numba)
+    names = [oamap.util.varname(avoid, "arg") for x in args]
+    params.extend(names)
+    fusedname = oamap.util.varname(avoid, "fused")
+
+    oamap.util.doexec("""
+def {fused}({params}):
+    if {conditions}:
+        return {fcn}({fcnargs})
+    else:
+        return {failed}
+""".format(fused=fusedname,
+           params=", ".join(fixed + params),
+           conditions=" and ".join(conditions),
+           fcn=fcnname,
+           fcnargs=", ".join(fixed + names),
+           failed=fixed[-1] if failed is None else failed), env)
+
+    return env[fusedname], tuple(x for predicate, predargs in predicates for x in predargs) + args
+
+def _sliceable(data):
+    # a top-level list with unit stride may be a slice of its partition (any whence and length); other proxies must start at zero
+    if isinstance(data, oamap.proxy.ListProxy):
+        return data._stride == 1
+    else:
+        return isinstance(data, oamap.proxy.Proxy) and data._index == 0
+
+def _viewoffsets(data, schema, listnode, listgenerator):
+    if isinstance(data, oamap.proxy.ListProxy):
+        if listnode is schema:
+            return numpy.array([data._whence, data._whence + data._length], dtype=oamap.generator.ListGenerator.posdtype)
+        starts, stops = data._generator._getstartsstops(data._arrays, data._cache)
+        if data._whence != starts[0] or data._length != stops[0] - starts[0]:
+            raise TypeError("only the top-level list of a sliced proxy can be operated upon, not {0}".format(repr(listnode.starts)))
+    viewstarts, viewstops = listgenerator._getstartsstops(data._arrays, data._cache)
+    return numpy.array([viewstarts.min(), viewstops.max()], dtype=oamap.generator.ListGenerator.posdtype)
+
+def _view(viewschema, viewarrays):
+    # views with the same schema share a generator, so that their Numba types and compiled functions are reused
+    return oamap.util.compiled(("view", viewschema.tojsonstring(explicit=True)), viewschema.generator)(viewarrays)
+
 class _DualSource(object):
     def __init__(self, old, oldns):
         self.old = old
@@ -612,6 +764,12 @@ def _parent_fill(starts, stops, pointers):
 parent.fill = _parent_fill
 del _parent_fill
 
+def _parent_plan(schema, fieldname, at):
+    return _pathnodes(schema, at)
+
+parent.plan = _parent_plan
+del _parent_plan
+
 transformations["parent"] = parent
 
 ################################################################ index
@@ -667,6 +825,12 @@ def _index_fill(starts, stops, pointers):
 index.fill = _index_fill
 del _index_fill
 
+def _index_plan(schema, fieldname, at):
+    return _pathnodes(schema, at)
+
+index.plan = _index_plan
+del _index_plan
+
 transformations["index"] = index
 
 ################################################################ tomask
@@ -720,6 +884,15 @@ def tomask(data, at, low, high=None):
     else:
         raise TypeError("tomask can only be applied to an OAMap proxy (List, Record, Tuple)")
 
+def _tomask_plan(schema, at, low, high=None):
+    nodes = _pathnodes(schema, at)
+    while isinstance(nodes[0], oamap.schema.List):
+        nodes.insert(0, nodes[0].content)
+    return nodes
+
+tomask.plan = _tomask_plan
+del _tomask_plan
+
 transformations["tomask"] = tomask
 
 ################################################################ flatten
@@ -761,6 +934,13 @@ def flatten(data, at=""):
     else:
         raise TypeError("flatten can only be applied to a top-level OAMap proxy (List, Record, Tuple)")
 
+def _flatten_plan(schema, at=""):
+    nodes = _pathnodes(schema, at)
+    return [nodes[0].content] + nodes
+
+flatten.plan = _flatten_plan
+del _flatten_plan
+
 transformations["flatten"] = flatten
 
 ################################################################ filter
@@ -772,7 +952,10 @@ def filter(data, fcn, args=(), at="", numba=True):
         except TypeError:
             args = (args,)
 
-    if (isinstance(data, oamap.proxy.ListProxy) and data._whence == 0 and data._stride == 1) or (isinstance(data, oamap.proxy.Proxy) and data._index == 0):
+    if isinstance(fcn, basestring):
+        fcn = oamap.util.trycompile(fcn, numba=False)                  # as a Python function, its parameters can be inspected
+
+    if _sliceable(data):
         schema = data._generator.namedschema()
         nodes = schema.path(at, parents=True)
         listnode = nodes[0]
@@ -785,20 +968,27 @@ def filter(data, fcn, args=(), at="", numba=True):
         
         if all(isinstance(x, (oamap.schema.Record, oamap.schema.Tuple)) for x in nodes[1:]):
             if listnode is schema:
-                view = listgenerator(data._arrays, numentries=len(data))
+                viewschema = listgenerator.namedschema()
+                viewarrays = _DualSource(data._arrays, data._generator.namespaces())
+                offsets = _viewoffsets(data, schema, listnode, listgenerator)
+                viewarrays.put(viewschema, offsets[:1], offsets[-1:])
+                view = _view(viewschema, viewarrays)
+            elif isinstance(data, oamap.proxy.ListProxy):
+                raise TypeError("path {0} does not refer to the top-level list".format(repr(at)))
             else:
                 view = listgenerator(data._arrays)
         else:
             if listnode is schema:
-                offsets = numpy.array([0, len(data)], dtype=oamap.generator.ListGenerator.posdtype)
+                offsets = _viewoffsets(data, schema, listnode, listgenerator)
                 viewstarts, viewstops = offsets[:1], offsets[-1:]
             else:
+                _viewoffsets(data, schema, listnode, listgenerator)
                 viewstarts, viewstops = listgenerator._getstartsstops(data._arrays, data._cache)
             viewschema = listgenerator.namedschema()
             viewarrays = _DualSource(data._arrays, data._generator.namespaces())
             viewoffsets = numpy.array([viewstarts.min(), viewstops.max()], dtype=oamap.generator.ListGenerator.posdtype)
             viewarrays.put(viewschema, viewoffsets[:1], viewoffsets[-1:])
-            view = viewschema(viewarrays)
+            view = _view(viewschema, viewarrays)
 
         params = fcn.__code__.co_varnames[:fcn.__code__.co_argcount]
         avoid = set(params)
@@ -843,6 +1033,8 @@ def {fill}({view}, {pointers}{params}):
             pointers = numpy.empty(len(view), dtype=oamap.generator.PointerGenerator.posdtype)
             numitems = fill(*((view, pointers) + args))
             pointers = pointers[:numitems]
+            if listnode is schema and view._whence != 0:
+                pointers += view._whence
             offsets = numpy.array([0, numitems], dtype=oamap.generator.ListGenerator.posdtype)
 
         else:
@@ -902,6 +1094,107 @@ def {fill}({view}, {viewstarts}, {viewstops}, {stops}, {pointers}{params}):
     else:
         raise TypeError("filter can only be applied to a top-level OAMap proxy (List, Record, Tuple)")
 
+def _filter_plan(schema, fcn, args=(), at="", numba=True):
+    return _fcnnodes(schema, fcn, at)
+
+filter.plan = _filter_plan
+del _filter_plan
+
+_zoneflipped = {ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+def _zonepossible(op, stats, partitionid, value):
+    # False only if no value in the partition's [min, max] range can satisfy "x op value"
+    if stats["nulls"][partitionid] > 0:
+        return True
+    lo, hi = stats["min"][partitionid], stats["max"][partitionid]
+    if op is ast.NotEq:
+        return stats["nans"][partitionid] > 0 or lo is None or not lo == hi == value
+    elif lo is None:
+        return False
+    elif op is ast.Gt:
+        return hi > value
+    elif op is ast.GtE:
+        return hi >= value
+    elif op is ast.Lt:
+        return lo < value
+    elif op is ast.LtE:
+        return lo <= value
+    else:
+        return lo <= value <= hi
+
+def _filter_prune(statistics, fcn, args=(), at="", numba=True):
+    # partitions that per-partition statistics prove have no passing entries, for string predicates
+    # made of and/or/comparisons between top-level fields and numbers (anything else might pass)
+    if not isinstance(fcn, basestring) or at != "" or len(statistics) == 0:
+        return set()
+    try:
+        body = ast.parse(fcn).body
+    except SyntaxError:
+        return set()
+    if len(body) != 1 or not isinstance(body[0], ast.Expr):
+        return set()
+    free = set(x.id for x in ast.walk(body[0]) if isinstance(x, ast.Name) and x.id not in ("None", "False", "True"))
+    if len(free) != 1 or (args != () and args != []):
+        return set()
+    obj, = free
+
+    def field(node):
+        path = []
+        while isinstance(node, ast.Attribute):
+            path.insert(0, node.attr)
+            node = node.value
+        if isinstance(node, ast.Name) and node.id == obj and "/".join(path) in statistics:
+            return "/".join(path)
+        else:
+            return None
+
+    def number(node):
+        sign = 1
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+            node = node.operand
+        if isinstance(node, getattr(ast, "Constant", ())):
+            value = node.value
+        elif isinstance(node, getattr(ast, "Num", ())):
+            value = node.n
+        else:
+            return None
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            return sign * value
+        else:
+            return None
+
+    def possible(node):
+        if isinstance(node, ast.BoolOp):
+            terms = [possible(x) for x in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda i: all(x(i) for x in terms)
+            else:
+                return lambda i: any(x(i) for x in terms)
+
+        elif isinstance(node, ast.Compare):
+            terms = []
+            operands = [node.left] + list(node.comparators)
+            for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+                op = type(op)
+                if op in _zoneflipped:
+                    path, value = field(left), number(right)
+                    if path is None or value is None:
+                        path, value, op = field(right), number(left), _zoneflipped[op]
+                    if path is not None and value is not None:
+                        terms.append((op, statistics[path], value))
+            return lambda i: all(_zonepossible(op, stats, i, value) for op, stats, value in terms)
+
+        else:
+            return lambda i: True
+
+    check = possible(body[0].value)
+    numpartitions = min(len(x["count"]) for x in statistics.values())
+    return set(i for i in range(numpartitions) if not check(i))
+
+filter.prune = _filter_prune
+del _filter_prune
+
 transformations["filter"] = filter
 
 ################################################################ define
@@ -913,6 +1206,9 @@ def define(data, fieldname, fcn, args=(), at="", fieldtype=None, numba=True):
         except TypeError:
             args = (args,)
 
+    if isinstance(fcn, basestring):
+        fcn = oamap.util.trycompile(fcn, numba=False)                  # as a Python function, its parameters can be inspected
+
     if (isinstance(data, oamap.proxy.ListProxy) and data._whence == 0 and data._stride == 1) or (isinstance(data, oamap.proxy.Proxy) and data._index == 0):
         schema = data._generator.namedschema()
         nodes = schema.path(at, parents=True)
@@ -936,7 +1232,7 @@ def define(data, fieldname, fcn, args=(), at="", fieldtype=None, numba=True):
                 raise NotImplementedError("'define' through a list defined by arrays that are not contiguous: view would require the creation of pointers")
 
             viewarrays.put(viewschema, viewstarts[:1], viewstops[-1:])   # unlike 'flatten', this does not preserve upper list structure (which is desirable here and not there)
-            view = viewschema(viewarrays)
+            view = _view(viewschema, viewarrays)
 
         else:
             recordnode = nodes[0]
@@ -944,7 +1240,7 @@ def define(data, fieldname, fcn, args=(), at="", fieldtype=None, numba=True):
             viewarrays = _DualSource(data._arrays, data._generator.namespaces())
             offsets = numpy.array([0, 1], dtype=oamap.generator.ListGenerator.posdtype)
             viewarrays.put(viewschema, offsets[:1], offsets[-1:])
-            view = viewschema(viewarrays)
+            view = _view(viewschema, viewarrays)
 
         params = fcn.__code__.co_varnames[:fcn.__code__.co_argcount]
         avoid = set(params)
@@ -1044,6 +1340,12 @@ def {fill}({view}, {primitive}, {mask}{params}):
     else:
         raise TypeError("define can only be applied to a top-level OAMap proxy (List, Record, Tuple)")
 
+def _define_plan(schema, fieldname, fcn, args=(), at="", fieldtype=None, numba=True):
+    return _fcnnodes(schema, fcn, at)
+
+define.plan = _define_plan
+del _define_plan
+
 transformations["define"] = define
 
 ################################################################ map
@@ -1055,8 +1357,12 @@ def map(data, fcn, args=(), at="", names=None, numba=True):
         except TypeError:
             args = (args,)
 
-    if (isinstance(data, oamap.proxy.ListProxy) and data._whence == 0 and data._stride == 1) or (isinstance(data, oamap.proxy.Proxy) and data._index == 0):
-        listnode = data._generator.namedschema().path(at)
+    if isinstance(fcn, basestring):
+        fcn = oamap.util.trycompile(fcn, numba=False)                  # as a Python function, its parameters can be inspected
+
+    if _sliceable(data):
+        schema = data._generator.namedschema()
+        listnode = schema.path(at)
         if not isinstance(listnode, oamap.schema.List):
             raise TypeError("path {0} does not refer to a list:\n\n    {1}".format(repr(at), listnode.__repr__(indent="    ")))
         if listnode.nullable:
@@ -1064,12 +1370,11 @@ def map(data, fcn, args=(), at="", names=None, numba=True):
 
         listgenerator = data._generator.findbynames("List", listnode.namespace, starts=listnode.starts, stops=listnode.stops)
 
-        viewstarts, viewstops = listgenerator._getstartsstops(data._arrays, data._cache)
         viewschema = listgenerator.namedschema()
         viewarrays = _DualSource(data._arrays, data._generator.namespaces())
-        viewoffsets = numpy.array([viewstarts.min(), viewstops.max()], dtype=oamap.generator.ListGenerator.posdtype)
+        viewoffsets = _viewoffsets(data, schema, listnode, listgenerator)
         viewarrays.put(viewschema, viewoffsets[:1], viewoffsets[-1:])
-        view = viewschema(viewarrays)
+        view = _view(viewschema, viewarrays)
 
         params = fcn.__code__.co_varnames[:fcn.__code__.co_argcount]
         avoid = set(params)
@@ -1086,13 +1391,14 @@ def map(data, fcn, args=(), at="", names=None, numba=True):
 
         if rtype is None:
             viewindex = 0
+            first = None
             for datum in view:
                 first = fcn(*((datum,) + args))
                 viewindex += 1
                 if first is not None:
                     break
 
-            if viewindex == len(view):
+            if first is None:
                 out = None
 
             else:
@@ -1265,21 +1571,55 @@ def {fill}({view}, {outs}{params}):
         raise TypeError("map can only be applied to a top-level OAMap proxy (List, Record, Tuple)")
 
 class MapCombiner(object):
-    def __init__(self, futures):
+    def __init__(self, futures, sizes=None):
         self._futures = futures
+        self._sizes = sizes
         self._result = None
+    def iterchunks(self, timeout=None):
+        for index, future in oamap.util.ascompleted(self._futures, timeout):
+            yield index, future.result()
     def result(self, timeout=None):
         if self._result is None:
-            starttime = time.time()
-            results = []
-            for future in self._futures:
-                if timeout is not None:
-                    timeout = max(1e-6, timeout - (time.time() - starttime))
-                results.append(future.result(timeout))
-            self._result = numpy.concatenate(results)
+            if self._sizes is None:
+                chunks = [None] * len(self._futures)
+                for index, chunk in self.iterchunks(timeout):
+                    chunks[index] = chunk
+                chunks = [x for x in chunks if x is not None]
+                if len(chunks) > 0:
+                    self._result = numpy.concatenate(chunks)
+
+            else:
+                # each partition's rows go into its upper-bound slot as soon as it finishes, then the gaps are closed in place
+                starts = numpy.cumsum([0] + list(self._sizes))
+                lengths = [0] * len(self._futures)
+                out = None
+                for index, chunk in self.iterchunks(timeout):
+                    if chunk is None:
+                        continue
+                    if len(chunk) > self._sizes[index]:
+                        raise AssertionError("partition {0} returned {1} rows, more than its bound {2}".format(index, len(chunk), self._sizes[index]))
+                    if out is None:
+                        out = numpy.empty(starts[-1], dtype=chunk.dtype)
+                    out[starts[index]:starts[index] + len(chunk)] = chunk
+                    lengths[index] = len(chunk)
+                    del chunk
+
+                if out is not None:
+                    numitems = 0
+                    for start, length in zip(starts, lengths):
+                        if numitems != start:
+                            out[numitems:numitems + length] = out[start:start + length]
+                        numitems += length
+                    out.resize(numitems, refcheck=False)
+                    self._result = out
+
         return self._result
     def done(self):
         return all(x.done() for x in self._futures)
+    def add_done_callback(self, fcn):
+        return oamap.util.ondone(self._futures, lambda: fcn(self))
+    def __await__(self):
+        return oamap.util.awaitable(self).__await__()
     def exception(self, timeout=None):
         raise NotImplementedError
     def traceback(self, timeout=None):
@@ -1288,8 +1628,32 @@ class MapCombiner(object):
 map.combiner = MapCombiner
 del MapCombiner
 
+def _map_plan(schema, fcn, args=(), at="", names=None, numba=True):
+    return _fcnnodes(schema, fcn, at)
+
+map.plan = _map_plan
+del _map_plan
+
+def _map_fuse(predicates, fcn, args=(), at="", names=None, numba=True):
+    fcn, args = _fusepredicates(predicates, fcn, args, 1, "None", numba)
+    return (fcn,), {"args": args, "at": at, "names": names, "numba": numba}
+
+map.fuse = _map_fuse
+del _map_fuse
+
 actions["map"] = map
 
+# operations that can be applied to a slice of a partition's top-level list (recastings, or with at="");
+# not reduce: every partition's fold starts from the tally, so splitting a partition would add the tally once per piece
+sliceable = set(list(recastings) + ["filter", "map"])
+
+# actions whose result is unchanged by skipping partitions that no entry passes; actions with an "empty" function
+# (reduce folds in one tally per partition) instead take its result for those partitions without reading them
+prunable = set(["map"])
+
+# operations that leave each partition with at most as many top-level entries as it started with
+boundedlength = set(["fieldname", "recordname", "keep", "drop", "filter", "define", "tomask", "parent", "index"])
+
 ################################################################ reduce
 
 def reduce(data, tally, fcn, args=(), at="", numba=True):
@@ -1299,20 +1663,23 @@ def reduce(data, tally, fcn, args=(), at="", numba=True):
         except TypeError:
             args = (args,)
 
-    if (isinstance(data, oamap.proxy.ListProxy) and data._whence == 0 and data._stride == 1) or (isinstance(data, oamap.proxy.Proxy) and data._index == 0):
-        listnode = data._generator.namedschema().path(at)
+    if isinstance(fcn, basestring):
+        fcn = oamap.util.trycompile(fcn, numba=False)                  # as a Python function, its parameters can be inspected
+
+    if _sliceable(data):
+        schema = data._generator.namedschema()
+        listnode = schema.path(at)
         if not isinstance(listnode, oamap.schema.List):
             raise TypeError("path {0} does not refer to a list:\n\n    {1}".format(repr(at), listnode.__repr__(indent="    ")))
         if listnode.nullable:
             raise NotImplementedError("nullable; need to merge masks")
 
         listgenerator = data._generator.findbynames("List", listnode.namespace, starts=listnode.starts, stops=listnode.stops)
-        viewstarts, viewstops = listgenerator._getstartsstops(data._arrays, data._cache)
         viewschema = listgenerator.namedschema()
         viewarrays = _DualSource(data._arrays, data._generator.namespaces())
-        viewoffsets = numpy.array([viewstarts.min(), viewstops.max()], dtype=oamap.generator.ListGenerator.posdtype)
+        viewoffsets = _viewoffsets(data, schema, listnode, listgenerator)
         viewarrays.put(viewschema, viewoffsets[:1], viewoffsets[-1:])
-        view = viewschema(viewarrays)
+        view = _view(viewschema, viewarrays)
 
         if fcn.__code__.co_argcount < 2:
             raise TypeError("function must have at least two parameters (data and tally)")
@@ -1360,19 +1727,29 @@ class ReduceCombiner(object):
         self._result = None
     def result(self, timeout=None):
         if self._result is None:
-            starttime = time.time()
-            result = None
-            for future in self._futures:
-                if timeout is not None:
-                    timeout = max(1e-6, timeout - (time.time() - starttime))
-                if result is None:
-                    result = future.result(timeout)
-                else:
-                    result = result + future.result(timeout)
-            self._result = result
+            # each partial result is merged with the runs of adjacent partitions on either side as soon as it arrives,
+            # always left + right (same order as a serial fold), so a straggler holds up only the merges that need it
+            runs = {}      # start -> (stop, value)
+            stops = {}     # stop -> start
+            for index, future in oamap.util.ascompleted(self._futures, timeout):
+                start, stop, value = index, index + 1, future.result()
+                if start in stops:
+                    start = stops.pop(start)
+                    value = runs.pop(start)[1] + value
+                if stop in runs:
+                    stop, right = runs.pop(stop)
+                    del stops[stop]
+                    value = value + right
+                runs[start] = (stop, value)
+                stops[stop] = start
+            self._result = runs[0][1] if len(runs) > 0 else None
         return self._result
     def done(self):
         return all(x.done() for x in self._futures)
+    def add_done_callback(self, fcn):
+        return oamap.util.ondone(self._futures, lambda: fcn(self))
+    def __await__(self):
+        return oamap.util.awaitable(self).__await__()
     def exception(self, timeout=None):
         raise NotImplementedError
     def traceback(self, timeout=None):
@@ -1381,4 +1758,24 @@ class ReduceCombiner(object):
 reduce.combiner = ReduceCombiner
 del ReduceCombiner
 
+def _reduce_plan(schema, tally, fcn, args=(), at="", numba=True):
+    return _fcnnodes(schema, fcn, at)
+
+reduce.plan = _reduce_plan
+del _reduce_plan
+
+def _reduce_fuse(predicates, tally, fcn, args=(), at="", numba=True):
+    fcn, args = _fusepredicates(predicates, fcn, args, 2, None, numba)
+    return (tally, fcn), {"args": args, "at": at, "numba": numba}
+
+reduce.fuse = _reduce_fuse
+del _reduce_fuse
+
+def _reduce_empty(tally, fcn, args=(), at="", numba=True):
+    # folding over no entries
+    return tally
+
+reduce.empty = _reduce_empty
+del _reduce_empty
+
 actions["reduce"] = reduce
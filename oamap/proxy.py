@@ -45,12 +45,12 @@ if sys.version_info[0] > 2:
 class Proxy(object): pass
 
 def tojson(value):
+    # proxies are converted a column at a time by walking their generators once
     if isinstance(value, ListProxy):
-        return [tojson(x) for x in value]
-    elif isinstance(value, RecordProxy):
-        return dict((n, tojson(getattr(value, n))) for n in value._fields)
-    elif isinstance(value, TupleProxy):
-        return [tojson(x) for x in value]
+        index = numpy.arange(value._whence, value._whence + value._stride*value._length, value._stride)
+        return _tojsoncolumn(value._generator.content, value._arrays, value._cache, index, True)
+    elif isinstance(value, (RecordProxy, TupleProxy)):
+        return _tojsoncolumn(value._generator, value._arrays, value._cache, numpy.array([value._index]), False)[0]
     elif isinstance(value, (numbers.Integral, numpy.integer)):
         return int(value)
     elif isinstance(value, (numbers.Real, numpy.floating)):
@@ -69,11 +69,96 @@ def tojson(value):
     else:
         return value
 
+def _tojsoncolumn(generator, arrays, cache, index, checkmask):
+    # JSON-ready values of the items at positions "index" (an integer array) of one generator
+    import oamap.generator
+    if len(index) == 0:
+        return []
+
+    if isinstance(generator, oamap.generator.ExtendedGenerator):
+        return [tojson(generator._generate(arrays, i, cache)) for i in index.tolist()]
+
+    if checkmask and isinstance(generator, oamap.generator.Masked):
+        mask = _asarray(generator._getmask(arrays, cache), generator.maskdtype)[index]
+        valid = (mask != generator.maskedvalue)
+        out = [None] * len(index)
+        for i, x in zip(numpy.nonzero(valid)[0].tolist(), _tojsoncolumn(generator, arrays, cache, mask[valid], False)):
+            out[i] = x
+        return out
+
+    if isinstance(generator, oamap.generator.PrimitiveGenerator):
+        data = _asarray(generator._getdata(arrays, cache), generator.dtype)[index]
+        if data.dtype.kind in "biu":
+            return data.tolist()
+        elif data.dtype.kind == "f" and len(data.shape) == 1:
+            out = data.tolist()
+            if not numpy.isfinite(data).all():
+                for i in numpy.nonzero(~numpy.isfinite(data))[0].tolist():
+                    out[i] = tojson(out[i])
+            return out
+        elif len(data.shape) > 1:
+            return data.tolist()
+        else:
+            return [tojson(x) for x in data]
+
+    elif isinstance(generator, oamap.generator.ListGenerator):
+        starts, stops = generator._getstartsstops(arrays, cache)
+        starts, stops = _asarray(starts, generator.posdtype)[index], _asarray(stops, generator.posdtype)[index]
+        counts = stops - starts
+        offsets = numpy.empty(len(counts) + 1, dtype=oamap.generator.ListGenerator.posdtype)
+        offsets[0] = 0
+        numpy.cumsum(counts, out=offsets[1:])
+        content = _tojsoncolumn(generator.content, arrays, cache, numpy.arange(offsets[-1], dtype=offsets.dtype) + numpy.repeat(starts - offsets[:-1], counts), True)
+        offsets = offsets.tolist()
+        return [content[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    elif isinstance(generator, oamap.generator.UnionGenerator):
+        tags, offsets = generator._gettagsoffsets(arrays, cache)
+        tags, offsets = _asarray(tags, generator.tagdtype)[index], _asarray(offsets, generator.offsetdtype)[index]
+        out = [None] * len(index)
+        for tag, possibility in enumerate(generator.possibilities):
+            selected = (tags == tag)
+            for i, x in zip(numpy.nonzero(selected)[0].tolist(), _tojsoncolumn(possibility, arrays, cache, offsets[selected], True)):
+                out[i] = x
+        return out
+
+    elif isinstance(generator, oamap.generator.RecordGenerator):
+        names = list(generator.fields)
+        columns = [_tojsoncolumn(generator.fields[n], arrays, cache, index, True) for n in names]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    elif isinstance(generator, oamap.generator.TupleGenerator):
+        columns = [_tojsoncolumn(x, arrays, cache, index, True) for x in generator.types]
+        return [list(row) for row in zip(*columns)]
+
+    elif isinstance(generator, oamap.generator.PointerGenerator):
+        positions = _asarray(generator._getpositions(arrays, cache), generator.posdtype)[index]
+        return _tojsoncolumn(generator.target, arrays, cache, positions, True)
+
+    else:
+        raise AssertionError(type(generator))
+
 def tojsonstring(value, *args, **kwds):
     return json.dumps(tojson(value), *args, **kwds)
 
 def tojsonfile(file, value, *args, **kwds):
-    json.dump(file, tojson(value), *args, **kwds)
+    # lists are written in chunks of "chunksize" items, so memory use does not grow with the list
+    chunksize = kwds.pop("chunksize", 100000)
+    if isinstance(value, ListProxy):
+        separators = kwds.get("separators", None)
+        if separators is None:
+            separators = (",", ": ") if kwds.get("indent", None) is not None and sys.version_info[0] > 2 else (", ", ": ")
+        file.write("[")
+        for start in range(0, len(value), chunksize):
+            if start > 0:
+                file.write(separators[0])
+            chunk = json.dumps(tojson(value[start:start + chunksize]), *args, **kwds)[1:-1]
+            if start + chunksize < len(value) and chunk.endswith("\n"):
+                chunk = chunk[:-1]                                     # with indent, the newline before "]" only ends the whole list
+            file.write(chunk)
+        file.write("]")
+    else:
+        json.dump(tojson(value), file, *args, **kwds)
 
 ################################################################ Lists
 
@@ -90,6 +175,10 @@ class ListProxy(Proxy):
         self._stride = stride
         self._length = length
 
+    def __reduce__(self):
+        # within oamap.util.sharedpickling(), plain-dict sources and loaded arrays are passed by name, not copied into the pickle
+        return (ListProxy, (self._generator, oamap.util.sharedmapping(self._arrays), self._cache, self._whence, self._stride, self._length))
+
     def __repr__(self, memo=None):
         if memo is None:
             memo = set()
@@ -135,6 +224,28 @@ class ListProxy(Proxy):
     def indexed(self):
         return self
 
+    def column(self, path):
+        # the backing array of a primitive field for all items of this list, without making proxies;
+        # lists along the path make a jagged (offsets, content) pair (nested for nested lists)
+        if self._stride == 1:
+            index = slice(self._whence, self._whence + self._length)
+        else:
+            index = numpy.arange(self._whence, self._whence + self._stride*self._length, self._stride)
+        names = [x for x in path.split("/") if x != ""]
+        return _column(self._generator.content, self._arrays, self._cache, index, None, names, path)
+
+    def iterbatches(self, size, columns=None):
+        # consecutive slices of this list as dicts of columns (see column), so that the cost is per batch, not per item
+        if not isinstance(size, (numbers.Integral, numpy.integer)) or size <= 0:
+            raise ValueError("size must be a positive integer (number of items per batch)")
+        if columns is None:
+            columns = _columnpaths(self._generator.content)
+        for start in xrange(0, self._length, size):
+            yield self[start : start + size]._batch(columns)
+
+    def _batch(self, columns):
+        return oamap.util.OrderedDict((path, self.column(path)) for path in columns)
+
     def __len__(self):
         return self._length
 
@@ -154,20 +265,129 @@ class ListProxy(Proxy):
 
             return ListProxy(self._generator, self._arrays, self._cache, whence, stride, length)
 
+        elif isinstance(index, (numpy.ndarray, list)):
+            return self._select(index)
+
         else:
             normalindex = index if index >= 0 else index + self._length
             if not 0 <= normalindex < self._length:
                 raise IndexError("index {0} is out of bounds for size {1}".format(index, self._length))
             return self._generator.content._generate(self._arrays, self._whence + self._stride*normalindex, self._cache)
 
+    def _select(self, index):
+        # a list of pointers to the selected items, built the way operations.filter builds its pointers
+        import oamap.schema
+        import oamap.generator
+        import oamap.operations
+        index = numpy.asarray(index)
+        if len(index.shape) != 1:
+            raise IndexError("only one-dimensional arrays can be used as indices")
+        if index.dtype == numpy.dtype(numpy.bool_):
+            if len(index) != self._length:
+                raise IndexError("boolean index has {0} items for a list of size {1}".format(len(index), self._length))
+            index = numpy.nonzero(index)[0]
+        elif len(index) == 0:
+            index = index.astype(oamap.generator.PointerGenerator.posdtype)
+        elif not issubclass(index.dtype.type, numpy.integer):
+            raise IndexError("arrays used as indices must be of integer or boolean type")
+        else:
+            index = numpy.where(index < 0, index + self._length, index)
+            if (index < 0).any() or (index >= self._length).any():
+                raise IndexError("index array is out of bounds for size {0}".format(self._length))
+
+        positions = numpy.asarray(self._whence + self._stride*index, dtype=oamap.generator.PointerGenerator.posdtype)
+
+        schema = self._generator.namedschema()
+        schema.nullable = False
+        if isinstance(self._generator.content, oamap.generator.PointerGenerator) and not isinstance(self._generator.content, oamap.generator.Masked):
+            positions = self._generator.content._getpositions(self._arrays, self._cache)[positions]
+            schema.content = oamap.schema.Pointer(schema.content.target)
+        else:
+            schema.content = oamap.schema.Pointer(schema.content)
+
+        arrays = oamap.operations._DualSource(self._arrays, self._generator.namespaces())
+        offsets = numpy.array([0, len(positions)], dtype=oamap.generator.ListGenerator.posdtype)
+        arrays.put(schema, offsets[:1], offsets[1:])
+        arrays.put(schema.content, positions)
+        return oamap.operations._view(schema, arrays)
+
+    def argsort(self, *paths, **kwds):
+        # stable ordering by the primitive columns at paths (first is most significant), with missing values last
+        reverse = kwds.pop("reverse", False)
+        if len(kwds) > 0:
+            raise TypeError("unrecognized options: {0}".format(", ".join(kwds)))
+        if len(paths) == 0:
+            paths = ("",)
+
+        keys = []
+        for path in reversed(paths):
+            column = self.column(path)
+            if isinstance(column, tuple) or len(column.shape) != 1:
+                raise TypeError("path {0} does not have one scalar value per item, so it can't be a sorting key".format(repr(path)))
+            if isinstance(column, numpy.ma.MaskedArray):
+                data, mask = numpy.ma.getdata(column), numpy.ma.getmaskarray(column)
+            else:
+                data, mask = column, None
+            if reverse:
+                # descending by value (negated rank), but the missing-value key stays ascending so that they stay last
+                data = -numpy.unique(data, return_inverse=True)[1].reshape(-1)
+            keys.append(data)
+            if mask is not None:
+                keys.append(mask)
+
+        return numpy.lexsort(keys)
+
+    def sorted_view(self, *paths, **kwds):
+        return self._select(self.argsort(*paths, **kwds))
+
     def __iter__(self):
-        return (self._generator.content._generate(self._arrays, i, self._cache) for i in xrange(self._whence, self._whence + self._stride*self._length, self._stride))
+        return self._scan(self._whence, self._stride)
+
+    def __reversed__(self):
+        return self._scan(self._whence + self._stride*(self._length - 1), -self._stride)
+
+    def _scan(self, first, stride):
+        # walks the backing arrays by stride: a strided NumPy view of non-nullable primitives, positions for anything else
+        import oamap.generator
+        content = self._generator.content
+        stop = first + stride*self._length
+        if type(content) is oamap.generator.PrimitiveGenerator and self._length > 0:
+            data = content._getdata(self._arrays, self._cache)
+            if isinstance(data, numpy.ndarray):
+                return iter(data[first : (stop if stop >= 0 else None) : stride])
+        return (content._generate(self._arrays, i, self._cache) for i in xrange(first, stop, stride))
+
+    def _primitives(self):
+        # the items as a NumPy array (a view, no copying) if they are non-nullable scalar primitives; otherwise None
+        import oamap.generator
+        content = self._generator.content
+        if type(content) is not oamap.generator.PrimitiveGenerator or content.dtype.shape != ():
+            return None
+        data = _asarray(content._getdata(self._arrays, self._cache), content.dtype)
+        stop = self._whence + self._stride*self._length
+        return data[self._whence : (stop if stop >= 0 else None) : self._stride]
 
     def __hash__(self):
         # lists aren't usually hashable, but since ListProxy is immutable, we can add this feature
+        data = self._primitives()
+        if data is not None:
+            return hash((ListProxy,) + tuple(data.tolist()))
         return hash((ListProxy,) + tuple(self))
 
     def __eq__(self, other):
+        if isinstance(other, (ListProxy, list)):
+            if len(self) != len(other):
+                return False
+            data = self._primitives()
+            if data is not None:
+                if isinstance(other, ListProxy):
+                    otherdata = other._primitives()
+                elif all(isinstance(x, (numbers.Real, numpy.number)) for x in other):
+                    otherdata = numpy.array(other)
+                else:
+                    otherdata = None
+                if otherdata is not None and otherdata.shape == data.shape:
+                    return bool((data == otherdata).all())
         if isinstance(other, ListProxy):
             return list(self) == list(other)
         elif isinstance(other, list):
@@ -176,6 +396,23 @@ class ListProxy(Proxy):
             return False
 
     def __lt__(self, other):
+        data = self._primitives()
+        if data is not None:
+            if isinstance(other, ListProxy):
+                otherdata = other._primitives()
+            elif isinstance(other, list) and all(isinstance(x, (numbers.Real, numpy.number)) for x in other):
+                otherdata = numpy.array(other)
+            else:
+                otherdata = None
+            if otherdata is not None and len(otherdata.shape) == 1:
+                # the first difference decides, as in Python's list comparison
+                length = min(len(data), len(otherdata))
+                different = numpy.nonzero(data[:length] != otherdata[:length])[0]
+                if len(different) > 0:
+                    return bool(data[different[0]] < otherdata[different[0]])
+                else:
+                    return len(data) < len(otherdata)
+
         if isinstance(other, ListProxy):
             return list(self) < list(other)
         elif isinstance(other, list):
@@ -193,12 +430,11 @@ class ListProxy(Proxy):
     def __add__(self, other): return list(self) + list(other)
     def __mul__(self, reps): return list(self) * reps
     def __rmul__(self, reps): return reps * list(self)
-    def __reversed__(self):
-        if sys.version_info[0] <= 2:
-            return (self[i - 1] for i in xrange(len(self), 0, -1))
-        else:
-            return (self[i - 1] for i in range(len(self), 0, -1))
-    def count(self, value): return sum(1 for x in self if x == value)
+    def count(self, value):
+        data = self._primitives()
+        if data is not None and isinstance(value, (numbers.Real, numpy.number)):
+            return int(numpy.count_nonzero(data == value))
+        return sum(1 for x in self if x == value)
     def index(self, value, *args):
         if len(args) == 0:
             start = 0
@@ -210,17 +446,113 @@ class ListProxy(Proxy):
             start, stop = args
         else:
             raise TypeError("index() takes at most 3 arguments ({0} given)".format(1 + len(args)))
-        for i, x in enumerate(self):
-            if x == value:
-                return i
+        start, stop, step = slice(start, stop).indices(len(self))
+        data = self._primitives()
+        if data is not None and isinstance(value, (numbers.Real, numpy.number)):
+            found = numpy.nonzero(data[start:stop] == value)[0]
+            if len(found) > 0:
+                return start + int(found[0])
+        else:
+            for i in xrange(start, stop):
+                if self[i] == value:
+                    return i
         raise ValueError("{0} is not in list".format(value))
 
     def __contains__(self, value):
+        data = self._primitives()
+        if data is not None and isinstance(value, (numbers.Real, numpy.number)):
+            return bool((data == value).any())
         for x in self:
             if x == value:
                 return True
         return False
 
+def _asarray(array, dtype):
+    if isinstance(array, numpy.ndarray):
+        return array
+    else:
+        return numpy.array(array, dtype=dtype)
+
+def _columnpaths(generator, path="", memo=None):
+    # paths to all primitives reachable through records, tuples, and lists: everything column can fetch
+    import oamap.generator
+    if memo is None:
+        memo = set()
+    if id(generator) in memo:
+        return []
+    memo.add(id(generator))
+    if isinstance(generator, oamap.generator.ExtendedGenerator):
+        return _columnpaths(generator.generic, path, memo)
+    elif isinstance(generator, oamap.generator.PrimitiveGenerator):
+        return [path]
+    elif isinstance(generator, oamap.generator.ListGenerator):
+        return _columnpaths(generator.content, path, memo)
+    elif isinstance(generator, oamap.generator.RecordGenerator):
+        return sum([_columnpaths(x, n if path == "" else path + "/" + n, memo) for n, x in generator.fields.items()], [])
+    elif isinstance(generator, oamap.generator.TupleGenerator):
+        return sum([_columnpaths(x, str(i) if path == "" else path + "/" + str(i), memo) for i, x in enumerate(generator.types)], [])
+    else:
+        return []
+
+def _column(generator, arrays, cache, index, valid, names, path):
+    # index is a slice (contiguous, so no copying) or an integer array (one gather); valid is None or a boolean mask of non-null items
+    import oamap.generator
+    while True:
+        if isinstance(generator, oamap.generator.ExtendedGenerator):
+            generator = generator.generic
+
+        if isinstance(generator, oamap.generator.Masked):
+            mask = _asarray(generator._getmask(arrays, cache), generator.maskdtype)[index]
+            isvalid = (mask != generator.maskedvalue)
+            valid = isvalid if valid is None else valid & isvalid
+            index = numpy.where(valid, mask, 0)
+
+        if isinstance(generator, oamap.generator.RecordGenerator):
+            if len(names) == 0 or names[0] not in generator.fields:
+                raise ValueError("path {0} does not lead to a primitive or list through records and lists".format(repr(path)))
+            generator, names = generator.fields[names[0]], names[1:]
+
+        elif isinstance(generator, oamap.generator.TupleGenerator):
+            try:
+                generator, names = generator.types[int(names[0])], names[1:]
+            except (IndexError, ValueError):
+                raise ValueError("path {0} does not lead to a primitive or list through records and lists".format(repr(path)))
+
+        elif isinstance(generator, oamap.generator.ListGenerator):
+            if valid is not None and not valid.all():
+                raise TypeError("path {0} passes through missing (None) lists, which have no jagged representation".format(repr(path)))
+            starts, stops = generator._getstartsstops(arrays, cache)
+            starts, stops = _asarray(starts, generator.posdtype)[index], _asarray(stops, generator.posdtype)[index]
+            counts = stops - starts
+            offsets = numpy.empty(len(counts) + 1, dtype=oamap.generator.ListGenerator.posdtype)
+            offsets[0] = 0
+            numpy.cumsum(counts, out=offsets[1:])
+            if len(counts) == 0:
+                index = slice(0, 0)
+            elif numpy.array_equal(starts[1:], stops[:-1]):
+                index = slice(starts[0], stops[-1])
+            else:
+                index = numpy.arange(offsets[-1], dtype=offsets.dtype) + numpy.repeat(starts - offsets[:-1], counts)
+            return offsets, _column(generator.content, arrays, cache, index, None, names, path)
+
+        elif isinstance(generator, oamap.generator.PointerGenerator):
+            index = _asarray(generator._getpositions(arrays, cache), generator.posdtype)[index]
+            generator = generator.target
+
+        elif isinstance(generator, oamap.generator.PrimitiveGenerator):
+            if len(names) != 0:
+                raise ValueError("path {0} continues past a primitive".format(repr(path)))
+            data = _asarray(generator._getdata(arrays, cache), generator.dtype)
+            if valid is None:
+                return data[index]
+            else:
+                out = numpy.zeros(len(valid), dtype=data.dtype)
+                out[valid] = data[index[valid]]
+                return numpy.ma.MaskedArray(out, mask=~valid)
+
+        else:
+            raise TypeError("path {0} passes through a {1}, which has no columnar representation".format(repr(path), generator.__class__.__name__))
+
 ################################################################ Records
 
 class RecordProxy(Proxy):
@@ -232,6 +564,9 @@ class RecordProxy(Proxy):
         self._cache = cache
         self._index = index
 
+    def __reduce__(self):
+        return (_recordproxy, (self._generator, oamap.util.sharedmapping(self._arrays), self._cache, self._index))
+
     def __repr__(self):
         return "<{0} at index {1}>".format("Record" if self._generator.name is None else self._generator.name, self._index)
 
@@ -283,6 +618,48 @@ class RecordProxy(Proxy):
     def __gt__(self, other): return not self.__lt__(other) and not self.__eq__(other)
     def __ge__(self, other): return not self.__lt__(other)
 
+def _recordproxy(generator, arrays, cache, index):
+    return generator._proxyclass(generator, arrays, cache, index)
+
+def _specializedrecord(generator):
+    # a RecordProxy subclass for one record type: each field is a property bound to its cache slot,
+    # skipping __getattr__ and the generic _generate dispatch
+    import oamap.generator
+
+    def accessor(fieldgenerator):
+        if type(fieldgenerator) is oamap.generator.PrimitiveGenerator:
+            dataidx = fieldgenerator.dataidx
+            def get(self):
+                data = self._cache[dataidx]
+                if data is None:
+                    data = fieldgenerator._getdata(self._arrays, self._cache)
+                return data[self._index]
+
+        elif type(fieldgenerator) is oamap.generator.MaskedPrimitiveGenerator:
+            dataidx, maskidx, maskedvalue = fieldgenerator.dataidx, fieldgenerator.maskidx, fieldgenerator.maskedvalue
+            def get(self):
+                mask = self._cache[maskidx]
+                if mask is None:
+                    mask = fieldgenerator._getmask(self._arrays, self._cache)
+                value = mask[self._index]
+                if value == maskedvalue:
+                    return None
+                data = self._cache[dataidx]
+                if data is None:
+                    data = fieldgenerator._getdata(self._arrays, self._cache)
+                return data[value]
+
+        else:
+            def get(self):
+                return fieldgenerator._generate(self._arrays, self._index, self._cache)
+
+        return property(get)
+
+    members = {}
+    for n, x in generator.fields.items():
+        members[n] = accessor(x)
+    return type("{0}RecordProxy".format("Specialized" if generator.name is None else generator.name), (RecordProxy,), members)
+
 ################################################################ Tuples
 
 class TupleProxy(Proxy):
@@ -294,6 +671,9 @@ class TupleProxy(Proxy):
         self._cache = cache
         self._index = index
 
+    def __reduce__(self):
+        return (TupleProxy, (self._generator, oamap.util.sharedmapping(self._arrays), self._cache, self._index))
+
     def __repr__(self, memo=None):
         if memo is None:
             memo = set()
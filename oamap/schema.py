@@ -36,6 +36,8 @@ import json
 import numbers
 import re
 import sys
+import threading
+import weakref
 from types import ModuleType
 
 import numpy
@@ -56,6 +58,40 @@ if sys.version_info[0] > 2:
 from oamap.extension.common import ByteString
 from oamap.extension.common import UTF8String
 
+# Generators are not modified after they're built, so schemas with the same content and options share one.
+# The key is the schema's explicit JSON, which is expensive for big schemas, so it's remembered per schema object:
+# every node of such a schema knows it (by id), and modifying a node (attribute assignment or item assignment/deletion/
+# insertion) forgets the keys of the schemas it's in. New nodes are in none, so building schemas doesn't forget any keys.
+generatorcachesize = 256
+_generatorcache = OrderedDict()
+_generatorlock = threading.Lock()
+
+_jsonkeys = {}
+
+def cleargenerators():
+    with _generatorlock:
+        _generatorcache.clear()
+        _jsonkeys.clear()
+
+def _modified(node):
+    for schemaid in node.__dict__.pop("_keyedby", ()):
+        _jsonkeys.pop(schemaid, None)
+
+def _jsonkey(schema):
+    key = id(schema)
+    memo = _jsonkeys.get(key)
+    if memo is not None and memo[0]() is schema:
+        return memo[1]
+    for node in schema.nodes():
+        node.__dict__.setdefault("_keyedby", set()).add(key)
+    out = schema.tojsonstring(explicit=True)
+    if key in schema.__dict__.get("_keyedby", ()):                     # not modified while it was being serialized
+        def cleanup(ref):
+            if _jsonkeys.get(key, (None,))[0] is ref:
+                del _jsonkeys[key]
+        _jsonkeys[key] = (weakref.ref(schema, cleanup), out)
+    return out
+
 # The "PLURTP" type system: Primitives, Lists, Unions, Records, Tuples, and Pointers
 
 class Schema(object):
@@ -65,6 +101,10 @@ class Schema(object):
     def __init__(self, *args, **kwds):
         raise TypeError("Kind cannot be instantiated directly")
 
+    def __setattr__(self, name, value):
+        _modified(self)
+        object.__setattr__(self, name, value)
+
     @property
     def nullable(self):
         return self._nullable
@@ -330,18 +370,46 @@ class Schema(object):
         import oamap.fill
         return self(oamap.fill.fromiterdata(values, generator=self, limit=limit, pointer_fromequal=pointer_fromequal))
 
-    def __call__(self, arrays, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None):
-        return self.generator(prefix=prefix, delimiter=delimiter, extension=self._normalize_extension(extension), packing=packing)(arrays)
+    def __call__(self, arrays, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None, specialize=False, limitbytes=None, prefetch=None):
+        return self.generator(prefix=prefix, delimiter=delimiter, extension=self._normalize_extension(extension), packing=packing, specialize=specialize)(arrays, limitbytes=limitbytes, prefetch=prefetch)
 
-    def generator(self, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None):
+    def generator(self, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None, specialize=False, memoize=True):
         if self._baddelimiter.match(delimiter) is not None:
             raise ValueError("delimiters must not contain /{0}/".format(self._baddelimiter.pattern))
+        extension = self._normalize_extension(extension)
+
+        try:
+            key = (_jsonkey(self), prefix, delimiter, tuple(extension), packing, specialize)
+            hash(key)
+        except (TypeError, ValueError):
+            key = None
+        if not memoize or key is None or generatorcachesize <= 0:
+            return self._buildgenerator(prefix, delimiter, extension, packing, specialize)
+
+        with _generatorlock:
+            out = _generatorcache.pop(key, None)
+            if out is not None:
+                _generatorcache[key] = out
+                return out
+
+        out = self._buildgenerator(prefix, delimiter, extension, packing, specialize)
+        with _generatorlock:
+            _generatorcache[key] = out
+            while len(_generatorcache) > generatorcachesize:
+                del _generatorcache[next(iter(_generatorcache))]
+        return out
+
+    def _buildgenerator(self, prefix, delimiter, extension, packing, specialize):
         cacheidx = [0]
         memo = OrderedDict()
-        extension = self._normalize_extension(extension)
         if packing is not None:
             packing = packing.copy()
-        return self._finalizegenerator(self._generator(prefix, delimiter, cacheidx, memo, set(), extension, packing), cacheidx, memo, extension, packing)
+        out = self._finalizegenerator(self._generator(prefix, delimiter, cacheidx, memo, set(), extension, packing), cacheidx, memo, extension, packing)
+        if specialize:
+            for generator in out.generators():
+                if isinstance(generator, oamap.generator.RecordGenerator):
+                    generator._specialize()
+        return out
 
     def _get_name(self, prefix, delimiter):
         if self._name is not None:
@@ -954,13 +1022,13 @@ class List(Schema):
     def _get_content(self, prefix, delimiter):
         return self._get_name(prefix, delimiter) + delimiter + "L"
 
-    def __call__(self, arrays, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None, numentries=None):
-        generator = self.generator(prefix=prefix, delimiter=delimiter, extension=self._normalize_extension(extension), packing=packing)
+    def __call__(self, arrays, prefix="object", delimiter="-", extension=oamap.extension.common, packing=None, numentries=None, specialize=False, limitbytes=None, prefetch=None):
+        generator = self.generator(prefix=prefix, delimiter=delimiter, extension=self._normalize_extension(extension), packing=packing, specialize=specialize)
         import oamap.generator
         if isinstance(generator, oamap.generator.ListGenerator):
-            return generator(arrays, numentries=numentries)
+            return generator(arrays, numentries=numentries, limitbytes=limitbytes, prefetch=prefetch)
         else:
-            return generator(arrays)
+            return generator(arrays, limitbytes=limitbytes, prefetch=prefetch)
 
     def _generator(self, prefix, delimiter, cacheidx, memo, nesting, extension, packing):
         if id(self) in nesting:
@@ -1060,6 +1128,7 @@ class Union(Schema):
         if not isinstance(possibility, Schema):
             raise TypeError("possibilities must be Schemas, not {0}".format(repr(possibility)))
         self._possibilities.append(possibility)
+        _modified(self)
 
     def insert(self, index, possibility):
         if isinstance(possibility, basestring):
@@ -1067,6 +1136,7 @@ class Union(Schema):
         if not isinstance(possibility, Schema):
             raise TypeError("possibilities must be Schemas, not {0}".format(repr(possibility)))
         self._possibilities.insert(index, possibility)
+        _modified(self)
 
     def extend(self, possibilities):
         self._extend(possibilities, self._possibilities)
@@ -1082,6 +1152,7 @@ class Union(Schema):
         if not isinstance(value, Schema):
             raise TypeError("possibilities must be Schemas, not {0}".format(repr(value)))
         self._possibilities[index] = value
+        _modified(self)
 
     def _hasarraynames(self, memo):
         if id(self) in memo:
@@ -1406,9 +1477,11 @@ class Record(Schema):
         if not isinstance(value, Schema):
             raise TypeError("field values must be Schemas, not {0}".format(repr(value)))
         self._fields[index] = value
+        _modified(self)
 
     def __delitem__(self, index):
         del self._fields[index]
+        _modified(self)
 
     def _hasarraynames(self, memo):
         if id(self) in memo:
@@ -1705,6 +1778,7 @@ class Tuple(Schema):
         if not isinstance(item, Schema):
             raise TypeError("types must be Schemas, not {0}".format(repr(item)))
         self._types.append(item)
+        _modified(self)
 
     def insert(self, index, item):
         if isinstance(item, basestring):
@@ -1712,6 +1786,7 @@ class Tuple(Schema):
         if not isinstance(item, Schema):
             raise TypeError("types must be Schemas, not {0}".format(repr(item)))
         self._types.insert(index, item)
+        _modified(self)
 
     def extend(self, types):
         self._extend(types, self._types)
@@ -1727,6 +1802,7 @@ class Tuple(Schema):
         if not isinstance(item, Schema):
             raise TypeError("types must be Schemas, not {0}".format(repr(value)))
         self._types[index] = value
+        _modified(self)
 
     def _hasarraynames(self, memo):
         if id(self) in memo:
@@ -28,8 +28,19 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import ast
+import atexit
+import io
+import math
+import numbers
+import os
+import pickle
 import sys
+import tempfile
+import threading
+import time
 import types
+import weakref
 
 import numpy
 
@@ -75,6 +86,11 @@ try:
 except ImportError:
     from collections import MutableMapping
 
+try:
+    from concurrent.futures import TimeoutError
+except ImportError:
+    class TimeoutError(Exception): pass
+
 try:
     from importlib import import_module
 except ImportError:
@@ -84,6 +100,302 @@ except ImportError:
             module = module.__dict__[name]
         return module
 
+################################################################ waiting on futures
+
+def ascompleted(futures, timeout=None):
+    # yields (index, future) in the order the futures finish; futures that can only report done() are polled
+    if not all(hasattr(x, "add_done_callback") for x in futures):
+        for x in _pollcompleted(futures, timeout):
+            yield x
+        return
+
+    condition = threading.Condition()
+    finished = []
+    def one(index):
+        def callback(future):
+            with condition:
+                finished.append(index)
+                condition.notify()
+        return callback
+
+    for index, future in enumerate(futures):
+        if future.add_done_callback(one(index)) is False:
+            raise TypeError("cannot mix futures that report completion with futures that do not")
+
+    deadline = None if timeout is None else time.time() + timeout
+    for count in range(len(futures)):
+        with condition:
+            while len(finished) == 0:
+                if deadline is None:
+                    condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError("{0} of {1} tasks did not finish in {2} seconds".format(len(futures) - count, len(futures), timeout))
+                    condition.wait(remaining)
+            index = finished.pop(0)
+        yield index, futures[index]
+
+def _pollcompleted(futures, timeout):
+    pending = list(enumerate(futures))
+    deadline = None if timeout is None else time.time() + timeout
+    wait = 1e-4
+    while len(pending) > 0:
+        stillpending = []
+        for index, future in pending:
+            if future.done():
+                wait = 1e-4
+                yield index, future
+            else:
+                stillpending.append((index, future))
+        pending = stillpending
+
+        if len(pending) > 0:
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError("{0} of {1} tasks did not finish in {2} seconds".format(len(pending), len(futures), timeout))
+            time.sleep(wait)
+            wait = min(2*wait, 0.01)
+
+def ondone(futures, callback):
+    # calls callback() once all futures are done, from whichever thread finishes the last one;
+    # returns False (registering nothing) if some future cannot report its completion
+    if not all(hasattr(x, "add_done_callback") for x in futures):
+        return False
+    if len(futures) == 0:
+        callback()
+        return True
+
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    def one(future):
+        with lock:
+            remaining[0] -= 1
+            last = (remaining[0] == 0)
+        if last:
+            callback()
+
+    for x in futures:
+        if x.add_done_callback(one) is False:
+            raise TypeError("cannot mix futures that report completion with futures that do not")
+    return True
+
+################################################################ asyncio
+
+def awaitable(future, loop=None, then=None, timeout=None, poll=False):
+    # an asyncio future for a concurrent.futures-style future; completion is forwarded to the event loop
+    # through add_done_callback if it is supported (no thread, no spinning), otherwise done() is checked
+    # on the loop's timers with a backoff (also done if poll is True, for completion from other processes)
+    import asyncio
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    out = loop.create_future() if hasattr(loop, "create_future") else asyncio.Future(loop=loop)
+
+    def settle(*ignore):
+        if not out.done():
+            try:
+                result = future.result()
+                if then is not None:
+                    result = then(result)
+            except Exception as err:
+                out.set_exception(err)
+            else:
+                out.set_result(result)
+
+    def expire():
+        if not out.done():
+            out.set_exception(TimeoutError("not done in {0} seconds".format(timeout)))
+
+    def check(delay):
+        if out.done():
+            pass
+        elif future.done():
+            settle()
+        else:
+            loop.call_later(delay, check, min(2*delay, 0.1))
+
+    if not hasattr(future, "add_done_callback") or future.add_done_callback(lambda x: loop.call_soon_threadsafe(settle)) is False or poll:
+        check(1e-4)
+    if timeout is not None:
+        loop.call_later(timeout, expire)
+    return out
+
+################################################################ shared-memory transport of arrays between processes
+
+def shareddir():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    else:
+        return tempfile.gettempdir()
+
+def sharedarray(array, directory=None):
+    if directory is None:
+        directory = shareddir()
+    fd, path = tempfile.mkstemp(prefix="oamap-", suffix=".npy", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            numpy.lib.format.write_array(file, array)
+    except:
+        os.unlink(path)
+        raise
+    return path
+
+def attacharray(path, unlink=False):
+    out = numpy.load(path, mmap_mode="c")
+    if unlink:
+        os.unlink(path)
+    return out.view(numpy.ndarray)
+
+class _SharedPickler(pickle.Pickler):
+    def __init__(self, file, directory, minbytes):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.minbytes = minbytes
+        self.paths = []
+
+    def persistent_id(self, obj):
+        if isinstance(obj, numpy.ndarray) and not obj.dtype.hasobject and obj.nbytes > 0 and obj.nbytes >= self.minbytes:
+            path = sharedarray(obj, self.directory)
+            self.paths.append(path)
+            return ("oamap.sharedarray", path)
+        else:
+            return None
+
+class _SharedUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        kind, path = pid
+        if kind == "oamap.sharedarray":
+            return attacharray(path, unlink=True)
+        else:
+            raise pickle.UnpicklingError("unrecognized persistent id {0}".format(repr(kind)))
+
+def shareddumps(obj, directory=None, minbytes=0):
+    # like pickle.dumps, but arrays are passed by name as memory-mapped files (in /dev/shm, if available)
+    if directory is None:
+        directory = shareddir()
+    file = io.BytesIO()
+    pickler = _SharedPickler(file, directory, minbytes)
+    byref = getattr(_sharing, "byref", None)
+    _sharing.byref = None                                              # this pickler passes whole arrays by name itself
+    try:
+        pickler.dump(obj)
+    except:
+        for path in pickler.paths:
+            os.unlink(path)
+        raise
+    finally:
+        _sharing.byref = byref
+    return file.getvalue()
+
+def sharedloads(data):
+    # arrays are mapped, not copied, and their files are unlinked as soon as they are mapped
+    return _SharedUnpickler(io.BytesIO(data)).load()
+
+# arrays referenced by name in pickles made within sharedpickling(): segments live as long as the array they were copied
+# from (and no longer than this process), so such pickles are for passing to other processes, not for saving data
+sharedminbytes = 65536
+
+_sharing = threading.local()
+_segments = {}
+
+class sharedpickling(object):
+    def __init__(self, directory=None, minbytes=None):
+        self.directory = directory
+        self.minbytes = minbytes
+
+    def __enter__(self):
+        self._previous = getattr(_sharing, "byref", None)
+        _sharing.byref = (self.directory, self.minbytes)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _sharing.byref = self._previous
+
+class SharedArrayRef(object):
+    def __init__(self, path, offset, dtype, shape):
+        self.path = path
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+
+    def __repr__(self):
+        return "SharedArrayRef({0}, {1}, {2}, {3})".format(repr(self.path), self.offset, repr(self.dtype), self.shape)
+
+    def attach(self):
+        if self.offset is None:
+            return attacharray(self.path)
+        else:
+            return numpy.memmap(self.path, dtype=self.dtype, mode="c", offset=self.offset, shape=self.shape).view(numpy.ndarray)
+
+def _memmapped(array):
+    root = array
+    while isinstance(root.base, numpy.ndarray):
+        root = root.base
+    if isinstance(root, numpy.memmap) and root.mode == "r" and root.filename is not None and os.path.exists(root.filename) and array.flags.c_contiguous:
+        return root.filename, root.offset + (array.ctypes.data - root.ctypes.data)
+    else:
+        return None
+
+def _sharedsegment(array, directory):
+    key = id(array)
+    if key in _segments and _segments[key][0]() is array:
+        return _segments[key][1]
+    path = sharedarray(array, directory)
+    def release(ref):
+        if key in _segments and _segments[key][0] is ref:
+            del _segments[key]
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    _segments[key] = (weakref.ref(array, release), path)
+    return path
+
+@atexit.register
+def _releasesegments():
+    for ref, path in list(_segments.values()):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    _segments.clear()
+
+def sharedref(array, directory=None, minbytes=None):
+    # within sharedpickling(), a reference to array's memory-mapped file or to a shared-memory copy of it (made once per array)
+    byref = getattr(_sharing, "byref", None)
+    if byref is None:
+        return array
+    if directory is None:
+        directory = byref[0]
+    if minbytes is None:
+        minbytes = sharedminbytes if byref[1] is None else byref[1]
+    if not isinstance(array, numpy.ndarray) or array.dtype.hasobject or array.nbytes < max(minbytes, 1):
+        return array
+    mapped = _memmapped(array)
+    if mapped is not None:
+        return SharedArrayRef(mapped[0], mapped[1], array.dtype, array.shape)
+    if directory is None:
+        directory = shareddir()
+    return SharedArrayRef(_sharedsegment(array, directory), None, array.dtype, array.shape)
+
+def attachref(obj):
+    if isinstance(obj, SharedArrayRef):
+        return obj.attach()
+    else:
+        return obj
+
+class SharedDict(dict):
+    def __reduce__(self):
+        return (_attachdict, (dict((n, sharedref(x)) for n, x in self.items()),))
+
+def _attachdict(refs):
+    return SharedDict((n, attachref(x)) for n, x in refs.items())
+
+def sharedmapping(arrays):
+    if type(arrays) is dict:
+        return SharedDict(arrays)
+    else:
+        return arrays
+
 def slice2sss(index, length):
     step = 1 if index.step is None else index.step
 
@@ -210,10 +522,248 @@ def paramtypes(args):
     else:
         return tuple(nb.typeof(x) for x in args)
 
+################################################################ arrays derived from other arrays
+
+_derived = {}
+
+def derived(array, key, build):
+    # build(array) is reused for as long as both the source array and the result live (if they can be weakly referenced);
+    # the memo never keeps a result alive by itself, so a result dropped everywhere else (e.g. evicted from an ArrayCache) is freed
+    try:
+        ref = weakref.ref(array)
+    except TypeError:
+        return build(array)
+
+    memokey = (id(array), key)
+    memo = _derived.get(memokey)
+    if memo is not None and memo[0]() is array:
+        out = memo[1]()
+        if out is not None:
+            return out
+
+    out = build(array)
+    def release(ref):
+        if memokey in _derived and ref in _derived[memokey]:
+            del _derived[memokey]
+    try:
+        _derived[memokey] = (weakref.ref(array, release), weakref.ref(out, release))
+    except TypeError:
+        pass
+    return out
+
+################################################################ instrumentation of array loading
+
+_recordings = []
+_threadrecordings = threading.local()
+
+def activerecordings():
+    return _recordings + getattr(_threadrecordings, "recordings", [])
+
+class Recording(object):
+    # while entered, counts array loads (per role name) and calls (getarrays, getall, backend, entercompiled) with their wall time;
+    # local recordings only see loads in their own thread
+    def __init__(self, local=False):
+        self.local = local
+        self.roles = OrderedDict()
+        self.calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<Recording {0} roles {1} loads {2} bytes>".format(len(self.roles), sum(x["loads"] for x in self.roles.values()), sum(x["bytes"] for x in self.roles.values()))
+
+    def __getstate__(self):
+        return {"local": self.local, "roles": self.roles, "calls": self.calls}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if self.local:
+            if not hasattr(_threadrecordings, "recordings"):
+                _threadrecordings.recordings = []
+            _threadrecordings.recordings.append(self)
+        else:
+            _recordings.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.local:
+            _threadrecordings.recordings.remove(self)
+        else:
+            _recordings.remove(self)
+
+    def call(self, name, seconds, count=1):
+        with self._lock:
+            tally = self.calls.get(name)
+            if tally is None:
+                tally = self.calls[name] = {"count": 0, "seconds": 0.0}
+            tally["count"] += count
+            tally["seconds"] += seconds
+
+    def role(self, name, loads=1, nbytes=0, conversions=0, convertedbytes=0, seconds=0.0):
+        with self._lock:
+            tally = self.roles.get(name)
+            if tally is None:
+                tally = self.roles[name] = {"loads": 0, "bytes": 0, "conversions": 0, "convertedbytes": 0, "seconds": 0.0}
+            tally["loads"] += loads
+            tally["bytes"] += nbytes
+            tally["conversions"] += conversions
+            tally["convertedbytes"] += convertedbytes
+            tally["seconds"] += seconds
+
+    def merge(self, other):
+        if isinstance(other, Recording):
+            other = other.tojson()
+        for name, tally in other["calls"].items():
+            self.call(name, tally["seconds"], tally["count"])
+        for name, tally in other["roles"].items():
+            self.role(name, tally["loads"], tally["bytes"], tally["conversions"], tally["convertedbytes"], tally["seconds"])
+
+    def tojson(self):
+        with self._lock:
+            return {"calls": OrderedDict((n, dict(x)) for n, x in self.calls.items()),
+                    "roles": OrderedDict((n, dict(x)) for n, x in self.roles.items())}
+
+    @staticmethod
+    def fromjson(data):
+        out = Recording()
+        out.merge(data)
+        return out
+
+    def summary(self, sortby="bytes"):
+        # one line per role, most expensive first
+        rows = sorted(self.tojson()["roles"].items(), key=lambda x: (-x[1][sortby], x[0]))
+        width = max([4] + [len(n) for n, x in rows])
+        out = ["{0:{1}s} {2:>8s} {3:>14s} {4:>11s} {5:>10s}".format("role", width, "loads", "bytes", "conversions", "seconds")]
+        for n, x in rows:
+            out.append("{0:{1}s} {2:8d} {3:14d} {4:11d} {5:10.4f}".format(n, width, x["loads"], x["bytes"], x["conversions"], x["seconds"]))
+        for n, x in self.tojson()["calls"].items():
+            out.append("{0} calls to {1} in {2:.4f} seconds".format(x["count"], n, x["seconds"]))
+        return "\n".join(out)
+
+################################################################ in-process cache of compiled functions
+
+compilecachesize = 256
+diskcache = False
+_compilecache = OrderedDict()
+_compilelock = threading.RLock()                                       # reentrant: building may compile nested functions
+
+class _Identity(object):
+    # stands for an object by identity; holds it weakly if it can, so that a later object with the same id() doesn't match
+    __slots__ = ("id", "ref")
+
+    def __init__(self, value):
+        self.id = id(value)
+        try:
+            self.ref = weakref.ref(value)
+        except TypeError:
+            self.ref = lambda: value
+
+    def __hash__(self):
+        return hash((_Identity, self.id))
+
+    def __eq__(self, other):
+        if not isinstance(other, _Identity) or self.id != other.id:
+            return False
+        value = self.ref()
+        return value is not None and value is other.ref()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+def _codekey(code):
+    return (code.co_code, code.co_argcount, code.co_varnames, code.co_names, tuple(_codekey(x) if isinstance(x, types.CodeType) else (type(x), x) for x in code.co_consts))
+
+def _valuekey(value, memo):
+    value = getattr(value, "py_func", value)
+    if isinstance(value, types.FunctionType):
+        return fcnkey(value, memo)
+    elif value is None or isinstance(value, (numbers.Number, basestring, bytes, numpy.dtype, numpy.generic)):
+        return (type(value), value)
+    elif isinstance(value, types.ModuleType):
+        return (types.ModuleType, value.__name__)
+    elif isinstance(value, tuple):
+        return (tuple, tuple(_valuekey(x, memo) for x in value))
+    else:
+        # other objects (e.g. arrays) are identified by identity: Numba freezes globals at compile time
+        return ("id", _Identity(value))
+
+def _globalnames(code):
+    out = set(code.co_names)
+    for x in code.co_consts:
+        if isinstance(x, types.CodeType):
+            out.update(_globalnames(x))
+    return out
+
+def fcnkey(fcn, memo=None):
+    # hashable stand-in for what a function computes: bytecode, constants, defaults, closure and referenced globals
+    if memo is None:
+        memo = set()
+    fcn = getattr(fcn, "py_func", fcn)
+    if not isinstance(fcn, types.FunctionType):
+        return None
+    if id(fcn) in memo:
+        return ("recursive", fcn.__name__)
+    memo.add(id(fcn))
+
+    try:
+        code = fcn.__code__
+        closure = tuple(_valuekey(x.cell_contents, memo) for x in fcn.__closure__ or ())
+        defaults = tuple(_valuekey(x, memo) for x in fcn.__defaults__ or ())
+        globs = tuple((n, _valuekey(fcn.__globals__[n], memo)) for n in sorted(_globalnames(code)) if n in fcn.__globals__)
+        out = (_codekey(code), defaults, closure, globs)
+        hash(out)
+    except (TypeError, ValueError):
+        return None
+    if any(x is None for x in closure + defaults) or any(x is None for n, x in globs):
+        return None
+    return out
+
+def compiled(key, build):
+    # build() is only called if no function has been compiled for this key (None means never cache)
+    if key is None:
+        return build()
+    with _compilelock:
+        try:
+            out = _compilecache[key]
+        except KeyError:
+            out = _compilecache[key] = build()
+            while len(_compilecache) > compilecachesize:
+                del _compilecache[list(_compilecache.keys())[0]]
+        except TypeError:
+            return build()
+        else:
+            del _compilecache[key]
+            _compilecache[key] = out
+        return out
+
+def clearcompiled():
+    with _compilelock:
+        for key in list(_compilecache.keys()):
+            del _compilecache[key]
+
+def argnames(fcn):
+    if isinstance(fcn, type):
+        fcn = fcn.__init__
+    try:
+        code = getattr(fcn, "__func__", fcn).__code__
+    except AttributeError:
+        return ()
+    return code.co_varnames[:code.co_argcount]
+
 def doexec(module, env):
     exec(module, env)
 
 def trycompile(fcn, paramtypes=None, numba=True):
+    if not isinstance(fcn, basestring):
+        key = fcnkey(fcn)
+        if key is not None:
+            numbakey = numba if isinstance(numba, (bool, type(None))) else _valuekey(tuple(sorted(numba.items())), set())
+            return compiled(("trycompile", key, paramtypes, numbakey), lambda: _trycompile(fcn, paramtypes, numba))
+    return _trycompile(fcn, paramtypes, numba)
+
+def _trycompile(fcn, paramtypes, numba):
     if isinstance(fcn, basestring):
         parsed = ast.parse(fcn).body
         if isinstance(parsed[-1], ast.Expr):
@@ -221,14 +771,14 @@ def trycompile(fcn, paramtypes=None, numba=True):
             parsed[-1].lineno = parsed[-1].value.lineno
             parsed[-1].col_offset = parsed[-1].value.col_offset
 
-        free = set()
+        free = []                                                      # in order of first appearance, which is the parameter order
         defined = set(["None", "False", "True"])
         def recurse(node):
             if isinstance(node, ast.Name):
                 if isinstance(node.ctx, ast.Store):
                     defined.add(node.id)
-                elif isinstance(node.ctx, ast.Load) and node.id not in defined:
-                    free.add(node.id)
+                elif isinstance(node.ctx, ast.Load) and node.id not in defined and node.id not in free:
+                    free.append(node.id)
             elif isinstance(node, ast.AST):
                 for n in node._fields:
                     recurse(getattr(node, n))
@@ -237,7 +787,7 @@ def trycompile(fcn, paramtypes=None, numba=True):
                     recurse(x)
         recurse(parsed)
 
-        avoid = free.union(defined)
+        avoid = defined.union(free)
         fcnname = varname(avoid, "fcn")
 
         module = ast.parse("""
@@ -265,7 +815,11 @@ def {fcn}({params}):
         numbaopts = numba
 
     if isinstance(fcn, nb.dispatcher.Dispatcher):
-        fcn = fcn.py_fcn
+        fcn = fcn.py_func
+
+    if diskcache and "cache" not in numbaopts and os.path.exists(fcn.__code__.co_filename):
+        # Numba's own on-disk cache only works for functions defined in source files
+        numbaopts = dict(numbaopts, cache=True)
 
     if paramtypes is None:
         return nb.jit(**numbaopts)(fcn)
@@ -29,6 +29,11 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import math
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 import unittest
 
@@ -36,6 +41,7 @@ from oamap.schema import *
 from oamap.database import *
 from oamap.dataset import *
 import oamap.operations
+import oamap.util
 
 class TestDatabase(unittest.TestCase):
     def runTest(self):
@@ -167,3 +173,319 @@ class TestDatabase(unittest.TestCase):
 
         self.assertEqual(len(db._backends[db._namespace]._refcounts.get(0, {})), 0)
         self.assertEqual(len(db._backends[db._namespace]._refcounts.get(1, {})), 0)
+
+    def test_multiprocess(self):
+        try:
+            executor = MultiprocessExecutor(2, minbytes=0)
+        except NotImplementedError:
+            return
+
+        db = InMemoryDatabase(executor=executor)
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}, {"x": 3, "y": 3.3}], [{"x": 4, "y": 4.4}, {"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}])
+        one = db.data.one
+
+        table = one.map(lambda obj: None if obj.x % 2 == 0 else (obj.x, obj.y, obj.x + obj.y))
+        self.assertEqual(table.result().tolist(), [(1, 1.1, 2.1), (3, 3.3, 6.3), (5, 5.5, 10.5)])
+
+        summary = one.reduce(0, lambda obj, tally: obj.x + tally)
+        self.assertEqual(summary.result(), sum([1, 2, 3, 4, 5, 6]))
+
+        self.assertRaises(TypeError, lambda: one.filter(lambda obj: obj.x % 2 == 0).transform("two", "", lambda x: x))
+
+        def fail(obj, tally):
+            raise ValueError("oops")
+        self.assertRaises(ValueError, lambda: one.reduce(0, fail, numba=False).result())
+
+        futures = [executor.submit(abs, -1), executor.submit(abs, -2)]
+        self.assertEqual(executor.submit(sum, futures).result(), 3)
+        def total(values):
+            return sum(values)
+        self.assertEqual(executor.submit(total, values=tuple(futures)).result(), 3)
+
+        wakeread, wakewrite = executor._wakeread, executor._wakewrite
+        executor.shutdown()
+        self.assertRaises(OSError, lambda: os.fstat(wakeread))
+        self.assertRaises(OSError, lambda: os.fstat(wakewrite))
+        self.assertRaises(RuntimeError, lambda: executor.submit(len, ()))
+
+    def test_async(self):
+        try:
+            import asyncio
+        except ImportError:
+            return
+        loop = asyncio.new_event_loop()
+
+        db = InMemoryDatabase(executor=MultiprocessExecutor(2) if hasattr(os, "fork") else SingleThreadExecutor())
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}, {"x": 3, "y": 3.3}], [{"x": 4, "y": 4.4}, {"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}])
+        one = loop.run_until_complete(db.aget("one", loop=loop))
+        self.assertEqual(loop.run_until_complete(one.reduce_async(0, lambda obj, tally: obj.x + tally, loop=loop)), 21)
+        self.assertEqual(loop.run_until_complete(one.map_async(lambda obj: obj.x, loop=loop)).tolist(), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(loop.run_until_complete(asyncio.ensure_future(one.map(lambda obj: obj.y > 3), loop=loop)).tolist(), [False, False, True, True, True, True])
+
+        directory = tempfile.mkdtemp()
+        try:
+            fsdb = FilesystemDatabase(directory)
+            self.assertRaises(oamap.util.TimeoutError, lambda: fsdb.get("two", timeout=0.01))
+            self.assertRaises(oamap.util.TimeoutError, lambda: loop.run_until_complete(fsdb.aget("two", timeout=0.01, loop=loop)))
+
+            def later():
+                time.sleep(0.05)
+                fsdb.fromdata("two", List("int32"), [1, 2, 3])
+            thread = threading.Thread(target=later)
+            thread.start()
+            two = loop.run_until_complete(fsdb.aget("two", timeout=10, loop=loop))
+            thread.join()
+            self.assertEqual(list(two[:]), [1, 2, 3])
+            self.assertTrue(fsdb._executor is not InMemoryDatabase()._executor)
+        finally:
+            shutil.rmtree(directory)
+            loop.close()
+
+    def test_partitioncache(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}, {"x": 3, "y": 3.3}], [{"x": 4, "y": 4.4}, {"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}])
+        one = db.data.one
+
+        one.partitioncache = PartitionCache(2)
+        self.assertEqual([one[i].x for i in [0, 3, 1, 4, 2, 5]], [1, 4, 2, 5, 3, 6])
+        self.assertEqual(one.partitioncache.misses, 2)
+        self.assertEqual(one.partitioncache.hits, 4)
+        self.assertEqual(one.partitioncache.partitionids, [0, 1])
+        self.assertTrue(one.partitioncache.nbytes > 0)
+
+        one.partitioncache = PartitionCache(2, maxbytes=0)
+        self.assertEqual([one[i].x for i in [0, 3, 1]], [1, 4, 2])
+        self.assertEqual(one.partitioncache.misses, 3)
+        self.assertEqual(one.partitioncache.partitionids, [0])
+
+        self.assertEqual(one[0:2], [one[0], one[1]])
+        self.assertEqual(one[1:3], [one[1], one[2]])
+        self.assertEqual(len(one.partition(0)), 3)
+
+    def test_prefetch(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}], [{"x": 3, "y": 3.3}, {"x": 4, "y": 4.4}], [{"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}])
+        one = db.data.one
+        one.prefetch = 1
+
+        self.assertEqual(one[0].x, 1)
+        self.assertEqual(one[2].x, 3)
+        thread, result = one._prefetching[2]
+        thread.join()
+        self.assertEqual(list(result[0]._generator.loaded(result[0]._cache)), list(one.partition(1)._generator.loaded(one.partition(1)._cache)))
+
+        self.assertEqual([obj.x for obj in one], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(one.reduce(0, lambda obj, tally: obj.x + tally).result(), 21)
+
+        one.partitioncache.clear()
+        chain = one.filter(lambda obj: obj.y > 2)
+        chain.partition(0)
+        thread, result = chain._prefetching[1]
+        thread.join()
+        schema = result[0]._generator.namedschema()
+        self.assertEqual(set(str(x) for x in result[0]._arrays._preloaded), set([schema.content["y"].data]))
+        self.assertEqual(chain.map(lambda obj: obj.x).result().tolist(), [2, 3, 4, 5, 6])
+
+    def test_plan(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64", "z": List("int32")})), [{"x": 1, "y": 1.1, "z": []}, {"x": 2, "y": 2.2, "z": [1]}], [{"x": 3, "y": 3.3, "z": [1, 2]}])
+        one = db.data.one
+        schema = one.partition(0)._generator.namedschema()
+
+        chain = one.filter(lambda obj: obj.x > 1)
+        self.assertEqual(set(str(x) for x in chain._plan(one.partition(0))), set([schema.starts, schema.stops, schema.content["x"].data]))
+
+        chain = one.drop("y").filter(lambda obj: len(obj.z) > 0).filter(lambda obj: obj.x > 1)
+        self.assertEqual(set(str(x) for x in chain._plan(one.partition(0))), set([schema.starts, schema.stops, schema.content["x"].data, schema.content["z"].starts, schema.content["z"].stops, schema.content["z"].content.data]))
+
+        partition = one.partition(1)
+        chain._preload(partition)
+        self.assertEqual(set(str(x) for x in partition._arrays._preloaded), set([schema.content["x"].data, schema.content["z"].starts, schema.content["z"].stops, schema.content["z"].content.data]))
+        result = partition
+        for operation in chain._operations:
+            result = operation.apply(result)
+        self.assertEqual([obj.x for obj in result], [3])
+        self.assertEqual(set(str(x) for x in partition._arrays._preloaded), set([schema.content["z"].content.data]))
+        chain._unpreload(partition)
+        self.assertEqual(partition._arrays._preloaded, {})
+
+        self.assertEqual(one.filter(lambda obj: obj.x > 1).reduce(0, lambda obj, tally: obj.x + tally).result(), 5)
+
+    def test_fusion(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}, {"x": 3, "y": 3.3}], [{"x": 4, "y": 4.4}, {"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}])
+        one = db.data.one
+
+        chain = one.define("z", lambda obj: obj.x * 2).filter(lambda obj, low: obj.x > low, (1,)).filter(lambda obj: obj.x < 6)
+
+        fused = chain._fused()
+        self.assertEqual(len(fused._operations), 3)
+        chain._operations = chain._operations + (Action("reduce", (0, lambda obj, tally: obj.x + tally), {}, oamap.operations.actions["reduce"]),)
+        fused = chain._fused()
+        self.assertEqual([x.name for x in fused._operations], ["reduce"])
+        chain._operations = chain._operations[:-1] + (Action("map", (lambda obj: obj.z,), {}, oamap.operations.actions["map"]),)
+        fused = chain._fused()
+        self.assertEqual([x.name for x in fused._operations], ["define", "map"])
+        chain._operations = chain._operations[:-1]
+
+        self.assertEqual(chain.reduce(0, lambda obj, tally: obj.x + tally).result(), 2 + 3 + 4 + 5)
+        self.assertEqual(chain.map(lambda obj: obj.x).result().tolist(), [2, 3, 4, 5])
+        self.assertEqual(chain.map(lambda obj: obj.z).result().tolist(), [4, 6, 8, 10])
+
+    def test_combiners(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": "float64"})), [{"x": 1, "y": 1.1}, {"x": 2, "y": 2.2}, {"x": 3, "y": 3.3}], [{"x": 4, "y": 4.4}, {"x": 5, "y": 5.5}, {"x": 6, "y": 6.6}], [{"x": 7, "y": 7.7}])
+        one = db.data.one
+
+        table = one.filter(lambda obj: obj.x != 2).map(lambda obj: None if obj.x == 5 else obj.x)
+        self.assertEqual(table._sizes, [3, 3, 1])
+        self.assertEqual(table.result().tolist(), [1, 3, 4, 6, 7])
+        self.assertEqual(sorted(index for index, chunk in table.iterchunks()), [0, 1, 2])
+
+        class SlowFuture(object):
+            def __init__(self, value, delay):
+                self.value = value
+                self.calls = delay
+            def done(self):
+                self.calls -= 1
+                return self.calls < 0
+            def result(self, timeout=None):
+                return self.value
+
+        futures = [SlowFuture([i], delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual([index for index, future in oamap.util.ascompleted(futures)], [1, 4, 3, 2, 0])
+        futures = [SlowFuture([i], delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual(oamap.operations.reduce.combiner(futures).result(), [0, 1, 2, 3, 4])
+        futures = [SlowFuture("abcde"[i], delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual(oamap.operations.reduce.combiner(futures).result(), "abcde")
+
+        class Tally(object):
+            merges = []
+            def __init__(self, value):
+                self.value = value
+            def __add__(self, other):
+                Tally.merges.append(self.value + other.value)
+                return Tally(self.value + other.value)
+        futures = [SlowFuture(Tally("abcde"[i]), delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual(oamap.operations.reduce.combiner(futures).result().value, "abcde")
+        self.assertEqual(Tally.merges, ["de", "bc", "bcde", "abcde"])
+
+        class CallbackFuture(SlowFuture):
+            def add_done_callback(self, fcn):
+                timer = threading.Timer(self.calls * 0.01, fcn, (self,))
+                timer.daemon = True
+                timer.start()
+        futures = [CallbackFuture([i], delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual(sorted(index for index, future in oamap.util.ascompleted(futures)), [0, 1, 2, 3, 4])
+        futures = [CallbackFuture([i], delay) for i, delay in enumerate([5, 0, 3, 1, 0])]
+        self.assertEqual(oamap.operations.reduce.combiner(futures).result(), [0, 1, 2, 3, 4])
+        self.assertRaises(oamap.util.TimeoutError, lambda: list(oamap.util.ascompleted([CallbackFuture(1, 1000)], timeout=0.01)))
+        self.assertRaises(oamap.util.TimeoutError, lambda: oamap.operations.reduce.combiner([SlowFuture(1, 10**9)]).result(timeout=0.01))
+
+    def test_stats(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": Primitive("float64", nullable=True), "z": List("float64")})), [{"x": 1, "y": 1.1, "z": []}, {"x": 2, "y": None, "z": [2.2]}], [{"x": 3, "y": 3.3, "z": []}, {"x": 4, "y": float("nan"), "z": []}], [{"x": 5, "y": 5.5, "z": [5.5]}])
+        one = db.data.one
+        self.assertEqual(sorted(one.stats), ["x", "y"])
+        self.assertEqual(one.stats["x"], {"count": [2, 2, 1], "nulls": [0, 0, 0], "nans": [0, 0, 0], "min": [1, 3, 5], "max": [2, 4, 5]})
+        self.assertEqual(one.stats["y"], {"count": [2, 2, 1], "nulls": [1, 0, 0], "nans": [0, 1, 0], "min": [1.1, 3.3, 5.5], "max": [1.1, 3.3, 5.5]})
+
+        self.assertEqual(one.filter("obj.x > 3")._pruned(), set([0]))
+        self.assertEqual(one.filter("2 <= obj.x <= 3 and obj.x != 2.5")._pruned(), set([2]))
+        self.assertEqual(one.filter("obj.x == 1 or obj.x == 5")._pruned(), set([1]))
+        self.assertEqual(one.filter("obj.x > 3 or len(obj.z) > 0")._pruned(), set())
+        self.assertEqual(one.filter("obj.y < 2")._pruned(), set([1, 2]))
+        self.assertEqual(one.filter("obj.y != 3.3")._pruned(), set())
+        self.assertEqual(one.filter(lambda obj: obj.x > 3)._pruned(), set())
+
+        misses = one.partitioncache.misses
+        self.assertEqual(one.filter("obj.x > 3").map("obj.x").result().tolist(), [4, 5])
+        self.assertEqual(one.partitioncache.misses - misses, 2)
+        self.assertEqual(one.filter("obj.x >= -1 and obj.x > 4.5").map("obj.x").result().tolist(), [5])
+        self.assertEqual(one.filter("obj.x > 100").reduce(0, "obj.x + tally").result(), 0)
+        self.assertEqual(one.drop("z").filter("obj.x < 2").reduce(0, "obj.x + tally").result(), 1)
+        self.assertEqual(one.filter("obj.x > 2").reduce(1, "obj.x + tally").result(), one.filter(lambda obj: obj.x > 2).reduce(1, lambda obj, tally: obj.x + tally).result())
+        misses = one.partitioncache.misses
+        self.assertEqual(one.filter("obj.x > 3").reduce(100, "obj.x + tally").result(), one.filter(lambda obj: obj.x > 3).reduce(100, lambda obj, tally: obj.x + tally).result())
+        self.assertEqual(one.partitioncache.misses - misses, 2 + 3)
+        self.assertEqual(one.filter("obj.x > 2").keep("x").map(lambda obj: obj.x).result().tolist(), [3, 4, 5])
+        self.assertEqual(one.filter("obj.x > 2").keep("x").reduce(0, "obj.x + tally").result(), 12)
+        self.assertEqual(one.define("w", "obj.x * 10", numba=False).filter("obj.w > 20").map("obj.w").result().tolist(), [30, 40, 50])
+
+        db.data.two = one.define("w", lambda obj: obj.x * 10, numba=False)
+        two = db.data.two
+        self.assertEqual(two.stats["w"]["max"], [20, 40, 50])
+        self.assertEqual(two.stats["x"], one.stats["x"])
+
+        masked = one.schema.deepcopy()
+        masked.content["x"].nullable = True
+        masked.content["x"].mask = "mask"
+        self.assertEqual(sorted(oamap.dataset._inheritstatistics(one.schema, one._stats, one.schema)), ["x", "y"])
+        self.assertEqual(sorted(oamap.dataset._inheritstatistics(one.schema, one._stats, masked)), ["y"])
+
+    def test_iterbatches(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": List("float64")})), [{"x": 1, "y": []}, {"x": 2, "y": [2.2]}, {"x": 3, "y": [3.3, 3.3]}, {"x": 4, "y": [4.4]}, {"x": 5, "y": []}], [{"x": 6, "y": [6.6]}, {"x": 7, "y": [7.7, 7.7]}])
+        one = db.data.one
+
+        batches = list(one.partition(0).iterbatches(2))
+        self.assertEqual([list(x) for x in batches], [["x", "y"]] * 3)
+        self.assertEqual([x["x"].tolist() for x in batches], [[1, 2], [3, 4], [5]])
+        self.assertEqual([x["y"][0].tolist() for x in batches], [[0, 0, 1], [0, 2, 3], [0, 0]])
+        self.assertEqual([x["y"][1].tolist() for x in batches], [[2.2], [3.3, 3.3, 4.4], []])
+
+        batches = list(one.iterbatches(3, columns=["y", "x"]))
+        self.assertEqual([list(x) for x in batches], [["y", "x"]] * 3)
+        self.assertEqual([x["x"].tolist() for x in batches], [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual([x["y"][0].tolist() for x in batches], [[0, 0, 1, 3], [0, 1, 1, 2], [0, 2]])
+        self.assertEqual([x["y"][1].tolist() for x in batches], [[2.2, 3.3, 3.3], [4.4, 6.6], [7.7, 7.7]])
+        self.assertEqual([x["x"].tolist() for x in one.iterbatches(100)], [[1, 2, 3, 4, 5, 6, 7]])
+        self.assertRaises(ValueError, lambda: list(one.iterbatches(0)))
+
+    def test_recording(self):
+        for executor in [SingleThreadExecutor()] + ([MultiprocessExecutor(2)] if hasattr(os, "fork") else []):
+            db = InMemoryDatabase(executor=executor)
+            db.fromdata("one", List(Record({"x": "int32", "y": List("float64")})), [{"x": 1, "y": []}, {"x": 2, "y": [2.2]}, {"x": 3, "y": [3.3, 3.3]}], [{"x": 4, "y": [4.4]}, {"x": 5, "y": []}])
+            one = db.data.one
+
+            result = one.map(lambda obj: obj.x)
+            self.assertFalse(hasattr(result, "recording"))
+            self.assertEqual(result.result().tolist(), [1, 2, 3, 4, 5])
+
+            with oamap.util.Recording() as recording:
+                result = one.map(lambda obj: obj.x * 10)
+                self.assertEqual(result.result().tolist(), [10, 20, 30, 40, 50])
+            for r in (recording, result.recording):
+                xname, = [n for n in r.roles if n.endswith("Fx-Di4")]
+                self.assertEqual(r.roles[xname]["loads"], 2)
+                self.assertEqual(r.roles[xname]["bytes"], 5*4)
+                self.assertFalse(any(n.endswith("Df8") for n in r.roles))
+                self.assertTrue(r.calls["getarrays"]["count"] > 0 and r.calls["getall"]["count"] > 0)
+                self.assertTrue(r.calls["backend"]["count"] >= 2)
+                self.assertTrue(xname in r.summary())
+            self.assertEqual(oamap.util.Recording.fromjson(recording.tojson()).tojson(), recording.tojson())
+            self.assertEqual(oamap.util.activerecordings(), [])
+
+    def test_splitsize(self):
+        db = InMemoryDatabase()
+        db.fromdata("one", List(Record({"x": "int32", "y": List("float64")})), [{"x": 1, "y": []}, {"x": 2, "y": [2.2]}, {"x": 3, "y": [3.3, 3.3]}, {"x": 4, "y": [4.4]}, {"x": 5, "y": []}], [{"x": 6, "y": [6.6]}, {"x": 7, "y": [7.7, 7.7]}])
+        one = db.data.one
+        one.splitsize = 2
+        self.assertEqual([x[:3] for x in one._pieces()], [(0, 0, 1), (0, 1, 3), (0, 3, 5), (1, None, None)])
+
+        self.assertEqual(one.map(lambda obj: obj.x).result().tolist(), [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(one.filter(lambda obj: obj.x % 2 == 1).map(lambda obj: obj.x).result().tolist(), [1, 3, 5, 7])
+        self.assertEqual(one.filter(lambda obj: obj.x != 3).map(lambda obj: (obj.x, len(obj.y))).result().tolist(), [(1, 0), (2, 1), (4, 1), (5, 0), (6, 1), (7, 2)])
+        self.assertEqual(one.reduce(0, lambda obj, tally: tally + obj.x).result(), 28)
+        self.assertEqual(one.reduce(100, lambda obj, tally: tally + obj.x).result(), 228)
+        self.assertEqual(one.drop("y").map(lambda obj: obj.x * 10).result().tolist(), [10, 20, 30, 40, 50, 60, 70])
+
+        # the pieces of a partition load its arrays once
+        with oamap.util.Recording() as recording:
+            self.assertEqual(one.filter(lambda obj: obj.x != 3).map(lambda obj: len(obj.y)).result().tolist(), [0, 1, 1, 0, 1, 2])
+        self.assertEqual(recording.calls["backend"]["count"], 2)
+        self.assertFalse(any(x._arrays._holding or len(x._arrays._preloaded) > 0 for x in one._partitioncache._partitions.values()))
+
+        self.assertTrue(one.drop("y").filter(lambda obj: obj.x > 3)._splittable())
+        self.assertFalse(one.filter(lambda y: y > 3, at="y")._splittable())
+        self.assertEqual(one.map(lambda y: y, at="y").result().tolist(), [2.2, 3.3, 3.3, 4.4, 6.6, 7.7, 7.7])
@@ -33,6 +33,8 @@ from collections import namedtuple
 
 import unittest
 
+import numpy
+
 try:
     import numba
 except ImportError:
@@ -40,6 +42,7 @@ except ImportError:
 
 from oamap.schema import *
 from oamap.operations import *
+import oamap.util
 
 Triple = namedtuple("Triple", ["one", "two", "three"])
 
@@ -497,3 +500,29 @@ class TestOperations(unittest.TestCase):
         data = List(Record({"hey": List(Record({"x": "int"}))})).fromdata([{"hey": [{"x": 1}, {"x": 2}, {"x": 3}]}, {"hey": []}, {"hey": [{"x": 4}, {"x": 5}]}])
         self.assertEqual(reduce(data, 0, lambda obj, tally: obj.x + tally, at="hey", numba=False), 15)
         self.assertEqual(reduce(data, 0, lambda obj, tally: obj.x + tally, at="hey", numba={"nopython": True}), 15)
+
+    def test_compiled(self):
+        def make(y):
+            return lambda obj, tally: obj.x + tally + y
+        self.assertEqual(oamap.util.fcnkey(make(1)), oamap.util.fcnkey(make(1)))
+        self.assertNotEqual(oamap.util.fcnkey(make(1)), oamap.util.fcnkey(make(2)))
+
+        array = numpy.arange(3)
+        self.assertEqual(oamap.util.fcnkey(make(array)), oamap.util.fcnkey(make(array)))
+        self.assertNotEqual(oamap.util.fcnkey(make(array)), oamap.util.fcnkey(make(numpy.arange(3))))
+        stale = oamap.util.fcnkey(make(array))
+        del array
+        reused = oamap.util.fcnkey(make(numpy.arange(3)))
+        reused[2][0][1].id = stale[2][0][1].id                         # as though the dead array's id() had been reused
+        self.assertEqual(hash(reused), hash(stale))
+        self.assertNotEqual(reused, stale)
+
+        oamap.util.clearcompiled()
+        one = List(Record({"x": "int"})).fromdata([{"x": 1}, {"x": 2}, {"x": 3}])
+        two = List(Record({"x": "int"})).fromdata([{"x": 4}, {"x": 5}])
+        self.assertEqual(reduce(one, 0, make(1)), 9)
+        numcompiled = len(oamap.util._compilecache)
+        self.assertEqual(reduce(two, 0, make(1)), 11)
+        self.assertEqual(len(oamap.util._compilecache), numcompiled)
+        self.assertEqual(reduce(two, 0, make(2)), 13)
+        self.assertTrue(len(oamap.util._compilecache) > numcompiled)
@@ -28,9 +28,20 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+import weakref
 
+import numpy
+
+import oamap.backend.packing
 import oamap.proxy
+import oamap.util
 from oamap.schema import *
 
 class TestProxy(unittest.TestCase):
@@ -117,6 +128,323 @@ class TestProxy(unittest.TestCase):
         self.assertEqual(x[-10:3], [[1.1, 2.2], None, [3.3, 4.4, 5.5]])
         self.assertEqual(x[1::2], [None])
 
+    def test_List_column(self):
+        x = List(Record({"x": Primitive("i8"), "y": List(Primitive("f8")), "z": Primitive("f8", nullable=True)}))({"object-B": [0], "object-E": [4], "object-L-Fx-Di8": [1, 2, 3, 4], "object-L-Fy-B": [0, 2, 2, 3], "object-L-Fy-E": [2, 2, 3, 5], "object-L-Fy-L-Df8": [1.1, 2.2, 3.3, 4.4, 5.5], "object-L-Fz-Df8": [1.5, 4.5], "object-L-Fz-M": [0, -1, -1, 1]})
+        self.assertEqual(x.column("x").tolist(), [1, 2, 3, 4])
+        self.assertEqual(x[1:3].column("x").tolist(), [2, 3])
+        self.assertEqual(x[::-2].column("x").tolist(), [4, 2])
+        self.assertEqual(x.column("z").tolist(), [1.5, None, None, 4.5])
+
+        offsets, content = x.column("y")
+        self.assertEqual(offsets.tolist(), [0, 2, 2, 3, 5])
+        self.assertEqual(content.tolist(), [1.1, 2.2, 3.3, 4.4, 5.5])
+        offsets, content = x[::2].column("y")
+        self.assertEqual(offsets.tolist(), [0, 2, 3])
+        self.assertEqual(content.tolist(), [1.1, 2.2, 3.3])
+        self.assertEqual([list(content[offsets[i]:offsets[i + 1]]) for i in range(2)], [list(x[0].y), list(x[2].y)])
+
+        x = List(List(Record({"a": Primitive("i4")})))({"object-B": [0], "object-E": [3], "object-L-B": [0, 2, 2], "object-L-E": [2, 2, 3], "object-L-L-Fa-Di4": [1, 2, 3]})
+        offsets, content = x.column("a")
+        self.assertEqual((offsets.tolist(), content.tolist()), ([0, 2, 2, 3], [1, 2, 3]))
+        self.assertRaises(ValueError, lambda: x.column("b"))
+
+    def test_List_select(self):
+        x = List(Record({"x": Primitive("i8"), "y": List(Primitive("f8"))}))({"object-B": [0], "object-E": [4], "object-L-Fx-Di8": [1, 2, 3, 4], "object-L-Fy-B": [0, 2, 2, 3], "object-L-Fy-E": [2, 2, 3, 5], "object-L-Fy-L-Df8": [1.1, 2.2, 3.3, 4.4, 5.5]})
+        selected = x[numpy.array([True, False, True, True])]
+        self.assertTrue(isinstance(selected.schema.content, Pointer))
+        self.assertEqual([r.x for r in selected], [1, 3, 4])
+        self.assertEqual([list(r.y) for r in selected], [[1.1, 2.2], [3.3], [4.4, 5.5]])
+        self.assertEqual([r.x for r in x[numpy.array([3, 0, -1, 3])]], [4, 1, 4, 4])
+        self.assertEqual([r.x for r in x[1:][[0, 2]]], [2, 4])
+        self.assertEqual([r.x for r in x[::-1][numpy.array([0, 1])]], [4, 3])
+        self.assertEqual([r.x for r in selected[numpy.array([2, 0])]], [4, 1])
+        self.assertEqual(len(x[numpy.array([], dtype=numpy.int64)]), 0)
+        self.assertRaises(IndexError, lambda: x[numpy.array([4])])
+        self.assertRaises(IndexError, lambda: x[numpy.array([True, False])])
+        self.assertEqual(list(x[0].y[numpy.array([1, 0])]), [2.2, 1.1])
+
+    def test_tojson(self):
+        x = List(Record({"x": Primitive("f8"), "y": List(Primitive("i8")), "z": Primitive("bool", nullable=True)}))({"object-B": [0], "object-E": [3], "object-L-Fx-Df8": [1.5, float("nan"), float("inf")], "object-L-Fy-B": [0, 2, 2], "object-L-Fy-E": [2, 2, 3], "object-L-Fy-L-Di8": [1, 2, 3], "object-L-Fz-Db1": [True], "object-L-Fz-M": [-1, 0, -1]})
+        expected = [{"x": 1.5, "y": [1, 2], "z": None}, {"x": "nan", "y": [], "z": True}, {"x": "inf", "y": [3], "z": None}]
+        self.assertEqual(oamap.proxy.tojson(x), expected)
+        self.assertEqual(oamap.proxy.tojson(x[::-2]), expected[::-2])
+        self.assertEqual(oamap.proxy.tojson(x[1]), expected[1])
+
+        for chunksize in [1, 2, 100]:
+            file = io.StringIO()
+            oamap.proxy.tojsonfile(file, x, chunksize=chunksize)
+            self.assertEqual(json.loads(file.getvalue()), expected)
+            for kwds in [{"separators": (",", ":")}, {"indent": 2}]:
+                file = io.StringIO()
+                oamap.proxy.tojsonfile(file, x, chunksize=chunksize, **kwds)
+                self.assertEqual(file.getvalue(), json.dumps(expected, **kwds))
+        file = io.StringIO()
+        oamap.proxy.tojsonfile(file, x[0])
+        self.assertEqual(json.loads(file.getvalue()), expected[0])
+
+    def test_List_primitive_fastpaths(self):
+        x = List(Primitive("i8"))({"object-B": [0], "object-E": [6], "object-L-Di8": numpy.array([3, 1, 4, 1, 5, 9])})
+        y = List(Primitive("f8"))({"object-B": [0], "object-E": [6], "object-L-Df8": numpy.array([3, 1, 4, 1, 5, 9], dtype=numpy.float64)})
+        z = List(Primitive("i8", nullable=True))({"object-B": [0], "object-E": [6], "object-L-Di8": [3, 1, 4, 1, 5], "object-L-M": [0, 1, 2, 3, 4, -1]})
+        self.assertTrue(x == y)
+        self.assertTrue(x == [3, 1, 4, 1, 5, 9])
+        self.assertFalse(x == [3, 1, 4, 1, 5, 8])
+        self.assertFalse(x == [3, 1, 4])
+        self.assertTrue(x[::-2] == [9, 1, 1])
+        self.assertTrue(x[1:4] == y[3:0:-1][::-1])
+        self.assertFalse(x == z)
+        self.assertEqual(hash(x), hash(y))
+        self.assertEqual(hash(x[1:3]), hash((oamap.proxy.ListProxy, 1, 4)))
+        self.assertEqual(x.count(1), 2)
+        self.assertEqual(z.count(1), 2)
+        self.assertEqual(z.count(None), 1)
+        self.assertEqual(x.index(1), 1)
+        self.assertEqual(x.index(1, 2), 3)
+        self.assertEqual(z.index(1, 2), 3)
+        self.assertEqual(x.index(9, -2), 5)
+        self.assertRaises(ValueError, lambda: x.index(1, 4))
+        self.assertRaises(ValueError, lambda: z.index(1, 4))
+        self.assertTrue(9 in x)
+        self.assertFalse(2 in x)
+        self.assertFalse(9 in x[:-1])
+        self.assertTrue(None in z)
+
+    def test_List_limitbytes(self):
+        arrays = {"object-B": [0], "object-E": [100], "object-L-Fa-Df8": numpy.arange(100, dtype=numpy.float64), "object-L-Fb-Df8": numpy.arange(100, dtype=numpy.float64)}
+        x = List(Record({"a": Primitive("f8"), "b": Primitive("f8")}))(arrays, limitbytes=1000)
+        cache = x._cache
+        self.assertTrue(isinstance(cache, oamap.generator.ArrayCache))
+        self.assertEqual(x[5].a, 5.0)
+        self.assertEqual(cache.nbytes, 800)
+        self.assertEqual(x[6].b, 6.0)
+        self.assertEqual(cache.nbytes, 800)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.bypath(x._generator), {"": 0, "a": 0, "b": 800})
+        self.assertEqual([y.a + y.b for y in x[:3]], [0.0, 2.0, 4.0])
+        self.assertTrue(cache.nbytes <= 1000)
+
+        owner = numpy.zeros(1)
+        cache.pin([i for i, y in enumerate(cache) if y is not None], owner)
+        self.assertEqual(x[7].a, 7.0)
+        self.assertEqual(cache.nbytes, 1600)
+        del owner
+        self.assertEqual(cache.pinned(), [])
+        self.assertEqual(cache.nbytes, 800)
+
+        y = pickle.loads(pickle.dumps(x))
+        self.assertEqual(y[8].a, 8.0)
+        self.assertEqual(y._cache.limitbytes, 1000)
+
+    def test_List_conversions(self):
+        source = numpy.arange(100, dtype=">f8")
+        arrays = {"object-B": [0], "object-E": [100], "object-L-Fa-Df8": source, "object-L-Fb-Di8": numpy.arange(100, dtype=numpy.int64)}
+        generator = List(Record({"a": Primitive("f8"), "b": Primitive("i8")})).generator(memoize=False)
+        x = generator(arrays, limitbytes=1000)
+        self.assertEqual(x[5].a, 5.0)
+        ref = weakref.ref(x._cache[x._generator.content.fields["a"].dataidx])
+        self.assertEqual(x[6].b, 6)
+        self.assertTrue(ref() is None)
+        self.assertFalse(any(memo[0]() is source for memo in oamap.util._derived.values()))
+
+        x = generator(arrays, limitbytes=1000)
+        self.assertEqual(x[5].a, 5.0)
+        converted = x._cache[x._generator.content.fields["a"].dataidx]
+        self.assertEqual(x[6].b, 6)
+        self.assertEqual(x._cache.evictions, 1)
+        self.assertEqual(x[7].a, 7.0)
+        self.assertTrue(x._cache[x._generator.content.fields["a"].dataidx] is converted)
+        self.assertEqual(source.dtype, numpy.dtype(">f8"))
+        self.assertEqual(source[3], 3.0)
+
+        class Fresh(object):
+            def getall(self, roles):
+                return dict((r, numpy.array([0]) if str(r) == "object-B" else numpy.array([100]) if str(r) == "object-E" else numpy.arange(100, dtype=">f8")) for r in roles)
+        y = List(Primitive("f8"))(Fresh())
+        self.assertEqual(list(y[:3]), [0.0, 1.0, 2.0])
+        self.assertEqual(y._cache[y._generator.content.dataidx].base.dtype, numpy.dtype(">f8"))
+
+        z = List(Primitive(">f8"))({"object-B": [0], "object-E": [100], "object-L-DF8": source})
+        self.assertTrue(z._cache[z._generator.content.dataidx] is None)
+        self.assertEqual(z[9], 9.0)
+        self.assertTrue(z._cache[z._generator.content.dataidx] is source)
+
+        counts = numpy.array([3, 0, 2])
+        starts, stops = oamap.backend.packing.ListCounts.fromcounts(counts)
+        self.assertTrue(oamap.backend.packing.ListCounts.fromcounts(counts)[0].base is starts.base)
+        ref = weakref.ref(starts.base)
+        del starts, stops
+        self.assertTrue(ref() is None)
+        self.assertEqual(oamap.backend.packing.ListCounts.fromcounts(counts)[1].tolist(), [3, 3, 5])
+
+    def test_List_entercompiled(self):
+        arrays = {"object-B": numpy.array([0]), "object-E": numpy.array([100]), "object-L-Fa-Df8": numpy.arange(100, dtype=numpy.float64), "object-L-Fb-Df8": numpy.arange(100, dtype=numpy.float64)}
+        generator = List(Record({"a": Primitive("f8"), "b": Primitive("f8")})).generator(memoize=False)
+        generator._requireall()
+        x = generator(arrays, limitbytes=2000)
+        one = x._generator._entercompiled(x._arrays, x._cache)
+        self.assertTrue(x._generator._entercompiled(x._arrays, x._cache) is one)
+        self.assertEqual(x._cache.pinned(), [0, 1, 2, 3])
+
+        x._cache[2] = None
+        two = x._generator._entercompiled(x._arrays, x._cache)
+        self.assertTrue(two is not one)
+        self.assertEqual(two[0].tolist(), [x._cache[i].ctypes.data for i in range(4)])
+        self.assertTrue(x._generator._entercompiled(x._arrays, x._cache) is two)
+
+        del one, two
+        x._cache.limitbytes = 1000
+        x._cache.evict()
+        self.assertTrue(x._cache._tables is None)
+        self.assertTrue(x._cache.nbytes <= 1000)
+
+    def test_List_reversed(self):
+        x = List(Primitive("i8"))({"object-B": [0], "object-E": [6], "object-L-Di8": numpy.array([3, 1, 4, 1, 5, 9])})
+        y = List(Record({"a": Primitive("i8")}))({"object-B": [0], "object-E": [6], "object-L-Fa-Di8": [3, 1, 4, 1, 5, 9]})
+        z = List(Primitive("i8", nullable=True))({"object-B": [0], "object-E": [6], "object-L-Di8": [3, 1, 4, 1, 5], "object-L-M": [0, 1, 2, 3, 4, -1]})
+        for index in [slice(None), slice(None, None, -1), slice(1, 5), slice(4, 0, -2), slice(None, None, 4), slice(None, None, -4), slice(3, 3), slice(None, 0, -1)]:
+            expected = [3, 1, 4, 1, 5, 9][index]
+            self.assertEqual(list(x[index]), expected)
+            self.assertEqual(list(reversed(x[index])), expected[::-1])
+            self.assertEqual([w.a for w in y[index]], expected)
+            self.assertEqual([w.a for w in reversed(y[index])], expected[::-1])
+            self.assertEqual(list(reversed(z[index])), [3, 1, 4, 1, 5, None][index][::-1])
+        self.assertEqual([type(w) for w in reversed(x)], [type(x[0])] * 6)
+
+    def test_List_argsort(self):
+        x = List(Record({"a": Primitive("i8"), "b": Primitive("f8"), "c": Primitive("i8", nullable=True)})).fromdata([{"a": 2, "b": 1.1, "c": 1}, {"a": 1, "b": 2.2, "c": None}, {"a": 2, "b": 0.5, "c": 3}, {"a": 1, "b": 2.2, "c": 0}])
+        self.assertEqual(x.argsort("a").tolist(), [1, 3, 0, 2])
+        self.assertEqual(x.argsort("a", "b").tolist(), [1, 3, 2, 0])
+        self.assertEqual(x.argsort("a", reverse=True).tolist(), [0, 2, 1, 3])
+        self.assertEqual(x.argsort("c").tolist(), [3, 0, 2, 1])
+        self.assertEqual(x.argsort("c", reverse=True).tolist(), [2, 0, 3, 1])
+        self.assertEqual(List(Primitive("i8", nullable=True)).fromdata([2, None, 1, 3]).argsort(reverse=True).tolist(), [3, 0, 2, 1])
+        self.assertEqual(x[::-1].argsort("b").tolist(), [1, 3, 0, 2])
+        self.assertEqual([(y.a, y.b) for y in x.sorted_view("b", "a")], [(2, 0.5), (2, 1.1), (1, 2.2), (1, 2.2)])
+        self.assertEqual([y.c for y in x.sorted_view("a", "c")], [0, None, 1, 3])
+        self.assertEqual([y.a for y in x.sorted_view("b").sorted_view("a", reverse=True)], [2, 2, 1, 1])
+        self.assertEqual(sorted(x, key=lambda y: y.b), list(x.sorted_view("b")))
+        self.assertRaises(TypeError, lambda: x.argsort("a", descending=True))
+
+        y = List(List(Primitive("i8"))).fromdata([[3, 1], [], [3, 1, 4], [2], [3, 0, 9]])
+        self.assertRaises(TypeError, lambda: y.argsort())
+        self.assertEqual(sorted(y), [[], [2], [3, 0, 9], [3, 1], [3, 1, 4]])
+        self.assertTrue(y[0] < y[2] and not y[2] < y[0] and y[4] < y[0] and y[1] < y[3] and not y[1] < y[1])
+        self.assertTrue(y[0] < [3, 2] and y[0] <= [3, 1] and not y[0] < [3, 1] and y[0] > [3] and y[3] >= [1, 5])
+        self.assertEqual(List(Primitive("f8")).fromdata([3.3, 1.1, 2.2]).argsort().tolist(), [1, 2, 0])
+
+    def test_List_pickle_shared(self):
+        arrays = {"object-B": [0], "object-E": [10000], "object-L-Fa-Df8": numpy.arange(10000, dtype=numpy.float64), "object-L-Fb-Di8": numpy.arange(10)}
+        x = List(Record({"a": Primitive("f8"), "b": Primitive("i8")}))(arrays)
+        self.assertEqual(x[9].a + x[9].b, 18)
+        self.assertTrue(len(pickle.dumps(x)) > 80000)
+        with oamap.util.sharedpickling():
+            data = pickle.dumps((x, x[9]))
+        self.assertTrue(len(data) < 10000)
+        y, y9 = pickle.loads(data)
+        self.assertTrue(y._cache is y9._cache)
+        self.assertEqual(y[9].a + y[9].b, 18)
+        self.assertEqual(y.column("a").tolist(), list(range(10000)))
+        self.assertTrue(isinstance(y._cache, oamap.generator.Cache))
+        self.assertEqual(pickle.loads(pickle.dumps(x))[9999].a, 9999)
+
+        directory = tempfile.mkdtemp()
+        try:
+            numpy.save(os.path.join(directory, "a.npy"), numpy.arange(20000, dtype=numpy.float64))
+            arrays["object-L-Fa-Df8"] = numpy.load(os.path.join(directory, "a.npy"), mmap_mode="r")[5000:]
+            x = List(Record({"a": Primitive("f8"), "b": Primitive("i8")}))(arrays)
+            self.assertEqual(x[1].a, 5001)
+            with oamap.util.sharedpickling():
+                ref = oamap.util.sharedref(x._cache[x._generator.content.fields["a"].dataidx])
+                data = pickle.dumps(x)
+            self.assertEqual(ref.path, os.path.join(directory, "a.npy"))
+            self.assertEqual(pickle.loads(data)[9999].a, 14999)
+            self.assertTrue(oamap.util.sharedref(x._cache[x._generator.content.fields["a"].dataidx]) is x._cache[x._generator.content.fields["a"].dataidx])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_prefetch_policies(self):
+        class Source(object):
+            def __init__(self, arrays):
+                self.arrays = arrays
+                self.calls = []
+            def getall(self, roles):
+                self.calls.append(sorted(str(x) for x in roles))
+                return dict((x, self.arrays[str(x)]) for x in roles)
+
+        schema = List(Record({"x": Primitive("i8"), "muons": List(Record({"pt": Primitive("f8"), "eta": Primitive("f8")}))}))
+        arrays = {"object-B": [0], "object-E": [2], "object-L-Fx-Di8": [1, 2], "object-L-Fmuons-B": [0, 1], "object-L-Fmuons-E": [1, 3], "object-L-Fmuons-L-Fpt-Df8": [1.1, 2.2, 3.3], "object-L-Fmuons-L-Feta-Df8": [0.1, 0.2, 0.3]}
+
+        source = Source(arrays)
+        x = schema(source)
+        self.assertEqual([(m.pt, m.eta) for m in x[1].muons], [(2.2, 0.2), (3.3, 0.3)])
+        self.assertEqual(len(source.calls), 4)
+
+        source = Source(arrays)
+        x = schema(source, prefetch=oamap.generator.PrefetchRecord())
+        self.assertEqual(x[1].x, 2)
+        self.assertEqual(source.calls[-1], ["object-L-Fmuons-B", "object-L-Fmuons-E", "object-L-Fx-Di8"])
+        self.assertEqual([(m.pt, m.eta) for m in x[1].muons], [(2.2, 0.2), (3.3, 0.3)])
+        self.assertEqual(source.calls[-1], ["object-L-Fmuons-L-Feta-Df8", "object-L-Fmuons-L-Fpt-Df8"])
+        self.assertEqual(len(source.calls), 3)
+
+        source = Source(arrays)
+        x = schema(source, prefetch=oamap.generator.PrefetchList())
+        self.assertEqual(x[0].x, 1)
+        self.assertEqual(len(source.calls[-1]), 5)
+        self.assertEqual(x[1].muons[1].eta, 0.3)
+        self.assertEqual(len(source.calls), 2)
+
+        learned = oamap.generator.PrefetchLearned()
+        source = Source(arrays)
+        x = schema(source, prefetch=learned)
+        self.assertEqual(sum(m.eta for m in x[0].muons), 0.1)
+        self.assertEqual(len(source.calls), 3)
+        learned = oamap.generator.PrefetchLearned.fromjson(json.loads(json.dumps(learned.tojson())))
+        source = Source(arrays)
+        x = schema(source, prefetch=learned)
+        self.assertEqual(sum(m.eta for m in x[1].muons), 0.5)
+        self.assertEqual(source.calls, [["object-B", "object-E", "object-L-Fmuons-B", "object-L-Fmuons-E", "object-L-Fmuons-L-Feta-Df8"]])
+        self.assertEqual(pickle.loads(pickle.dumps(schema(arrays, prefetch=learned)))[0].x, 1)
+
+        learned = oamap.generator.PrefetchLearned()
+        self.assertEqual(schema(arrays, prefetch=learned)[0].muons[0].eta, 0.1)
+        for i in range(6):
+            self.assertEqual(schema(arrays, prefetch=learned)[0].x, 1)
+        self.assertEqual(learned.counts["object-L-Fmuons-L-Feta-Df8"], 1)
+        source = Source(arrays)
+        self.assertEqual(schema(source, prefetch=learned)[0].x, 1)
+        self.assertEqual(source.calls[-1], ["object-L-Fx-Di8"])
+
+    def test_generator_memoized(self):
+        schema = List(Record({"a": Primitive("i8"), "b": List(Primitive("f8"))}))
+        generator = schema.generator()
+        self.assertTrue(generator is List(Record({"a": "i8", "b": List("f8")})).generator())
+        self.assertTrue(generator is not schema.generator(prefix="other"))
+        self.assertTrue(generator is not schema.generator(extension={}))
+        self.assertTrue(generator is not schema.generator(memoize=False))
+
+        arrays = {"object-B": [0], "object-E": [2], "object-L-Fa-Di8": [1, 2], "object-L-Fb-B": [0, 1], "object-L-Fb-E": [1, 3], "object-L-Fb-L-Df8": [1.1, 2.2, 3.3]}
+        one, two = schema(arrays), schema(arrays)
+        self.assertTrue(one._generator is two._generator and one._cache is not two._cache)
+        self.assertEqual(one[1].b, [2.2, 3.3])
+
+        calls = []
+        tojsonstring = schema.tojsonstring
+        schema.tojsonstring = lambda *args, **kwds: calls.append(kwds) or tojsonstring(*args, **kwds)
+        self.assertTrue(schema.generator() is generator)
+        self.assertEqual(calls, [{"explicit": True}])
+        self.assertTrue(schema.generator() is generator)
+        self.assertEqual(calls, [{"explicit": True}])
+        List(Record({"c": Primitive("i8", nullable=True)})).generator()
+        self.assertTrue(schema.generator() is generator)
+        self.assertEqual(calls, [{"explicit": True}])
+        del schema.tojsonstring
+
+        schema.content["b"].content.nullable = True
+        self.assertTrue(schema.generator() is not generator)
+        self.assertTrue(isinstance(schema.generator().content.fields["b"].content, oamap.generator.Masked))
+        self.assertFalse(isinstance(generator.content.fields["b"].content, oamap.generator.Masked))
+
     def test_Union(self):
         self.assertEqual(Union([Primitive("i8"), Primitive("f8")])({"object-T": [0], "object-O": [0], "object-U0-Di8": [1], "object-U1-Df8": []}), 1)
         self.assertEqual(List(Union([Primitive("i8"), Primitive("f8")]))({"object-B": [0], "object-E": [7], "object-L-T": [0, 0, 1, 1, 1, 0, 0], "object-L-O": [0, 1, 0, 1, 2, 2, 3], "object-L-U0-Di8": [1, 2, 3, 4], "object-L-U1-Df8": [1.1, 2.2, 3.3]}), [1, 2, 1.1, 2.2, 3.3, 3, 4])
@@ -175,6 +503,25 @@ class TestProxy(unittest.TestCase):
         self.assertEqual(x[2].y, 2.2)
         self.assertEqual(x[3], 98)
 
+    def test_Record_specialized(self):
+        arrays = {"object-B": [0], "object-E": [3], "object-L-Fx-Di8": [1, 2, 3], "object-L-Fy-Df8": [2.2], "object-L-Fy-M": [-1, 0, -1], "object-L-Fz-B": [0, 0, 1], "object-L-Fz-E": [0, 1, 3], "object-L-Fz-L-Di8": [4, 5, 6]}
+        schema = List(Record({"x": Primitive("i8"), "y": Primitive("f8", nullable=True), "z": List(Primitive("i8"))}))
+        generic = schema(arrays)
+        specialized = schema(arrays, specialize=True)
+        self.assertIs(type(generic[0]), oamap.proxy.RecordProxy)
+        self.assertIsNot(type(specialized[0]), oamap.proxy.RecordProxy)
+        self.assertEqual(type(specialized[0]).__name__, "SpecializedRecordProxy")
+        self.assertEqual(type(List(Record({"x": "i8"}, name="Point"))({"object-B": [0], "object-E": [1], "object-L-NPoint-Fx-Di8": [1]}, specialize=True)[0]).__name__, "PointRecordProxy")
+        self.assertTrue(isinstance(specialized[0], oamap.proxy.RecordProxy))
+        self.assertEqual([(r.x, r.y, list(r.z)) for r in specialized], [(r.x, r.y, list(r.z)) for r in generic])
+        self.assertEqual(list(specialized), list(generic))
+        self.assertEqual(specialized[1].fields, ["x", "y", "z"])
+        self.assertRaises(AttributeError, lambda: specialized[1].w)
+
+        generator = pickle.loads(pickle.dumps(schema.generator(specialize=True)))
+        self.assertIsNot(type(generator(arrays)[0]), oamap.proxy.RecordProxy)
+        self.assertEqual(generator(arrays)[1].y, 2.2)
+
     def test_Tuple(self):
         x = Tuple((Primitive("i8"), Primitive("f8")))({"object-F0-Di8": [3], "object-F1-Df8": [3.14]})
         self.assertEqual(x[0], 3)